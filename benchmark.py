@@ -0,0 +1,375 @@
+"""画像取得・検索・TXT/GoodNotes 書き出し・PDF 作成のベンチマーク（Streamlit なし）。
+
+アプリと同じ関数を直接呼び、ケースごとの所要時間を JSON に書き出す。
+画像リンクはローカルに立てた代役 HTTP サーバーへ差し替えるので、ネットワークに依存しない。
+画像キャッシュも一時ディレクトリを使う（create_pdf の1回目はキャッシュなし、2回目以降はキャッシュあり）。
+
+    python benchmark.py                                  # 97_119DB / 97_118DB と、その4倍の合成データ
+    python benchmark.py --scale 1 4 16 --pdf-rows 600 --pdf-workers 4 --out bench.json
+    python benchmark.py --baseline bench_main.json       # 基準より遅くなったケースがあれば終了コード 1
+"""
+import argparse
+import functools
+import http.server
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pandas as pd
+
+HERE = Path(__file__).parent
+DEFAULT_CSVS = ["97_119DB.csv", "97_118DB.csv"]
+# 実際によく使う形の検索語（1語・AND・英数字・1文字・URL の一部）
+DEFAULT_QUERIES = ["歯", "レジン & 硬さ", "う蝕", "Ⅳ", "118", "http", "小児 & 乳歯 & 萌出"]
+# 出典（試験回・領域・問番号）の指定
+EXAM_QUERIES = ["110-119c", "118a", "97a1", "105-110b & レジン", "100-119 & 歯"]
+RESULT_VERSION = 1
+
+
+# ===== 代役の画像サーバー =====
+def make_images(directory: Path) -> list[str]:
+    """大きめの写真相当の JPEG・小さい JPEG・透過 PNG を作り、ファイル名を返す。"""
+    from PIL import Image, ImageDraw
+
+    names = []
+    for i in range(4):
+        im = Image.new("RGB", (2400, 1800), (40 * i, 120, 200 - 40 * i))
+        draw = ImageDraw.Draw(im)
+        for k in range(0, 2400, 60):
+            draw.line((k, 0, 2400 - k, 1800), fill=((k * 7 + i * 50) % 256, 80, 160), width=9)
+        name = f"photo{i}.jpg"
+        im.save(directory / name, quality=90)
+        names.append(name)
+    Image.new("RGB", (400, 300), (30, 90, 200)).save(directory / "small.jpg", quality=90)
+    names.append("small.jpg")
+    Image.new("RGBA", (600, 400), (255, 0, 0, 128)).save(directory / "alpha.png")
+    names.append("alpha.png")
+    return names
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    """/throttle/ 以下は4件に1件 429 を返す（Drive の流量制限の代役）"""
+    _count = 0
+    _lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.startswith("/throttle/"):
+            with self._lock:
+                _QuietHandler._count += 1
+                throttled = _QuietHandler._count % 4 == 0
+            if throttled:
+                self.send_response(429)
+                self.send_header("Retry-After", "0")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.path = self.path[len("/throttle"):]
+        super().do_GET()
+
+
+def start_image_server(directory: Path) -> http.server.ThreadingHTTPServer:
+    handler = functools.partial(_QuietHandler, directory=str(directory))
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# ===== コーパス =====
+def localize_links(df: pd.DataFrame, base_url: str, image_names: list[str]) -> pd.DataFrame:
+    """画像リンクを代役サーバーの URL に置き換える（同じリンクは同じ画像になる）"""
+    df = df.copy()
+    if "リンクURL" in df.columns:
+        def _local(link):
+            if not str(link).strip():
+                return link
+            name = image_names[zlib.crc32(str(link).encode("utf-8")) % len(image_names)]
+            return f"{base_url}/{name}"
+        df["リンクURL"] = df["リンクURL"].map(_local)
+    return df
+
+
+def write_corpus(df: pd.DataFrame, scale: int, path: Path) -> Path:
+    """df を scale 回繰り返した CSV を書く（問題文に通し番号を付けて別の問題にする）"""
+    if scale > 1:
+        parts = []
+        for k in range(scale):
+            part = df.copy()
+            if k and "問題文" in part.columns:
+                part["問題文"] = part["問題文"] + f" [{k}]"
+            parts.append(part)
+        df = pd.concat(parts, ignore_index=True)
+    df.to_csv(path, index=False, encoding="utf-8-sig")
+    return path
+
+
+def bench_fetch(results, base_url: str, image_names: list[str], args):
+    """キャッシュを通さない取得そのもの（同時数制限・再試行込み）"""
+    from image_fetch import ImageFetcher, RetryPolicy
+
+    count = max(args.fetch_count, 0)
+    if not count:
+        return
+    for case, prefix in (("fetch_images", ""), ("fetch_images_throttled", "/throttle")):
+        urls = [f"{base_url}{prefix}/{image_names[i % len(image_names)]}?n={i}" for i in range(count)]
+        fetcher = ImageFetcher(policy=RetryPolicy(base_delay=0.01))
+        seconds, _ = measure(lambda: fetcher.get_many(urls), 1)
+        _record(results, "images", 1, count, case, seconds, metrics=fetcher.metrics.snapshot())
+
+
+# ===== 計測 =====
+def measure(fn, repeat: int):
+    seconds, result = [], None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        result = fn()
+        seconds.append(time.perf_counter() - t)
+    return seconds, result
+
+
+def _record(results, corpus: str, scale: int, rows: int, case: str, seconds, **extra):
+    entry = {
+        "corpus": corpus,
+        "scale": scale,
+        "rows": rows,
+        "case": case,
+        "seconds": [round(s, 6) for s in seconds],
+        "min": round(min(seconds), 6),
+        "median": round(statistics.median(seconds), 6),
+    }
+    if extra:
+        entry["extra"] = extra
+    results.append(entry)
+    print(f"{corpus:>16} x{scale:<3} {case:<26} median {entry['median']:.4f}s", file=sys.stderr)
+
+
+def bench_corpus(results, corpus: str, scale: int, csv_path: Path, args, work_dir: Path):
+    from ngram_index import NgramIndex
+    from pdf_export import PARALLEL_MIN_RECORDS, create_pdf, create_pdf_parallel
+    from exam_ids import ExamIndex
+    from pdf_fragments import FragmentStore
+    from question_engine import QuestionEngine
+    from question_dedupe import find_duplicates
+    from ranking import BM25Ranker
+    from question_db import build_snapshot, load_questions, read_question_csv
+    from question_search import (
+        SESSION_CACHE_ENTRIES,
+        ResultCache,
+        build_search_text,
+        filter_questions,
+        parse_keywords,
+    )
+    from text_export import dataframe_to_goodnotes_bytes, records_to_text
+
+    seconds, df = measure(lambda: read_question_csv(csv_path), args.repeat)
+    rows = len(df)
+    _record(results, corpus, scale, rows, "read_csv_normalize", seconds)
+
+    seconds, _ = measure(lambda: build_snapshot(csv_path), 1)
+    _record(results, corpus, scale, rows, "build_snapshot", seconds)
+    seconds, df = measure(lambda: load_questions(csv_path), args.repeat)
+    _record(results, corpus, scale, rows, "load_snapshot", seconds)
+
+    seconds, search_text = measure(lambda: build_search_text(df), args.repeat)
+    _record(results, corpus, scale, rows, "build_search_text", seconds)
+    texts = search_text.tolist()
+    seconds, index = measure(lambda: NgramIndex.build(texts), args.repeat)
+    _record(results, corpus, scale, rows, "build_ngram_index", seconds)
+
+    # アプリの起動時と同じ読み込み（スナップショットと保存済みインデックスから）
+    index_dir = work_dir / "index_cache"
+    QuestionEngine(csv_path, index_dir=index_dir)  # 1回目でインデックスを保存する
+    seconds, _ = measure(lambda: QuestionEngine(csv_path, index_dir=index_dir), args.repeat)
+    _record(results, corpus, scale, rows, "open_engine", seconds)
+
+    hits = {}
+    def run_queries():
+        for q in args.queries:
+            hits[q] = len(filter_questions(df, index, parse_keywords(q)))
+    seconds, _ = measure(run_queries, args.repeat)
+    _record(results, corpus, scale, rows, "keyword_filter", seconds, queries=len(args.queries), hits=hits)
+
+    # 出典の指定（出典のインデックスの二分探索）と、試験回の新しい順への並べ替え
+    seconds, exams = measure(lambda: ExamIndex.from_frame(df), args.repeat)
+    _record(results, corpus, scale, rows, "build_exam_index", seconds)
+    exam_hits = {}
+    def run_exam_queries():
+        for q in EXAM_QUERIES:
+            exam_hits[q] = len(filter_questions(df, index, parse_keywords(q), exam_index=exams, order="exam_desc"))
+    seconds, _ = measure(run_exam_queries, args.repeat)
+    _record(results, corpus, scale, rows, "exam_filter", seconds, queries=len(EXAM_QUERIES), hits=exam_hits)
+
+    # 関連度順（BM25）で上位50件だけを取り出す
+    seconds, ranker = measure(lambda: BM25Ranker(df, index), args.repeat)
+    _record(results, corpus, scale, rows, "build_ranker", seconds)
+    def run_ranked_queries():
+        for q in args.queries:
+            filter_questions(df, index, parse_keywords(q), order="relevance", ranker=ranker, limit=50)
+    seconds, _ = measure(run_ranked_queries, args.repeat)
+    _record(results, corpus, scale, rows, "rank_top50", seconds, queries=len(args.queries))
+
+    # 1文字ずつ打ち込む検索（キャッシュなし／セッションの直近結果から絞り込み）
+    def type_queries(incremental: bool):
+        shared = ResultCache() if incremental else None
+        for q in args.queries:
+            session = ResultCache(SESSION_CACHE_ENTRIES) if incremental else None
+            for end in range(1, len(q) + 1):
+                filter_questions(df, index, parse_keywords(q[:end]),
+                                 cache=shared, db_version="bench", session_cache=session)
+    keystrokes = sum(len(q) for q in args.queries)
+    for case, incremental in (("typing_filter", False), ("typing_filter_incremental", True)):
+        seconds, _ = measure(lambda: type_queries(incremental), args.repeat)
+        _record(results, corpus, scale, rows, case, seconds, keystrokes=keystrokes)
+
+    seconds, text = measure(lambda: records_to_text(df), args.repeat)
+    _record(results, corpus, scale, rows, "text_export", seconds, bytes=len(text.encode("utf-8")))
+
+    seconds, data = measure(lambda: dataframe_to_goodnotes_bytes(df), args.repeat)
+    _record(results, corpus, scale, rows, "goodnotes_export", seconds, bytes=len(data))
+
+    # ほぼ重複の問題の検出（MinHash + LSH。合成データでは倍率の分だけ同じ問題が並ぶ）
+    seconds, (_, stats) = measure(lambda: find_duplicates([csv_path]), args.repeat)
+    _record(results, corpus, scale, rows, "find_duplicates", seconds,
+            candidates=stats["candidate_pairs"], clusters=stats["clusters"])
+
+    if args.pdf_rows <= 0:
+        return
+    records = df.head(args.pdf_rows)
+    pdf_path = work_dir / f"{corpus}_x{scale}.pdf"
+    # 並列版は件数・プロセス数が足りないと1プロセスの create_pdf に切り替わるので、そのときは測らない
+    parallel = functools.partial(create_pdf_parallel, workers=args.pdf_workers)
+    cases = [("create_pdf", create_pdf, {})]
+    if len(records) >= PARALLEL_MIN_RECORDS and args.pdf_workers > 1:
+        cases.append(("create_pdf_parallel", parallel, {"workers": args.pdf_workers}))
+    else:
+        print(f"create_pdf_parallel は省略（{PARALLEL_MIN_RECORDS}件以上・2プロセス以上で測る）", file=sys.stderr)
+    for case, render, extra in cases:
+        def run_pdf():
+            with open(pdf_path, "wb") as f:
+                render(records, out=f)
+        seconds, _ = measure(run_pdf, args.repeat)
+        _record(results, corpus, scale, len(records), case, seconds, bytes=pdf_path.stat().st_size, **extra)
+
+    # 全問題の断片を事前に作り、書き出しは詰めて描くだけにした場合
+    seconds, (_, store) = measure(lambda: FragmentStore.build(csv_path), 1)
+    _record(results, corpus, scale, rows, "build_fragments", seconds, fragments=len(store))
+    def run_pdf_fragments():
+        with open(pdf_path, "wb") as f:
+            create_pdf(records, out=f, store=store)
+    seconds, _ = measure(run_pdf_fragments, args.repeat)
+    _record(results, corpus, scale, len(records), "create_pdf_fragments", seconds, bytes=pdf_path.stat().st_size)
+
+
+# ===== 基準との比較 =====
+def compare(results, baseline_path: Path, tolerance: float, min_delta: float) -> list[str]:
+    """中央値が基準の (1 + tolerance) 倍を超え、かつ min_delta 秒以上遅いケースを返す。"""
+    baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+    before = {(r["corpus"], r["scale"], r["case"]): r for r in baseline.get("results", [])}
+    regressions = []
+    for r in results:
+        old = before.get((r["corpus"], r["scale"], r["case"]))
+        if old is None:
+            continue
+        ratio = r["median"] / old["median"] if old["median"] else float("inf")
+        if ratio > 1 + tolerance and r["median"] - old["median"] > min_delta:
+            regressions.append(
+                f"{r['corpus']} x{r['scale']} {r['case']}: {old['median']:.4f}s -> {r['median']:.4f}s ({ratio:.2f}x)"
+            )
+    return regressions
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=HERE, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("csv", nargs="*", default=DEFAULT_CSVS, help="対象の問題DB CSV")
+    parser.add_argument("--scale", type=int, nargs="+", default=[1, 4], help="合成データの倍率（1 は元のまま）")
+    parser.add_argument("--repeat", type=int, default=3, help="各ケースの繰り返し回数")
+    parser.add_argument("--pdf-rows", type=int, default=300,
+                        help="PDF 作成に使う先頭の件数（0 で省略。並列版は pdf_export.PARALLEL_MIN_RECORDS 以上で測る）")
+    parser.add_argument("--pdf-workers", type=int, default=max(2, os.cpu_count() or 1),
+                        help="並列版の PDF 作成のプロセス数（既定: CPU 数。1CPU でも 2）")
+    parser.add_argument("--fetch-count", type=int, default=200, help="画像取得ケースの件数（0 で省略）")
+    parser.add_argument("--query", dest="queries", action="append", help="検索語（複数指定可）")
+    parser.add_argument("--out", default="bench_results.json", help="結果の JSON")
+    parser.add_argument("--baseline", help="比較する以前の結果 JSON")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="遅くなったとみなす割合")
+    parser.add_argument("--min-delta", type=float, default=0.05, help="これ未満の差（秒）は誤差とみなす")
+    args = parser.parse_args(argv)
+    args.queries = args.queries or DEFAULT_QUERIES
+
+    with tempfile.TemporaryDirectory(prefix="dental_db_bench_") as tmp:
+        work_dir = Path(tmp)
+        # 画像キャッシュは使い捨てにする（get_image_cache より前に設定）
+        os.environ["IMAGE_CACHE_DIR"] = str(work_dir / "image_cache")
+        image_dir = work_dir / "images"
+        image_dir.mkdir()
+        image_names = make_images(image_dir)
+        server = start_image_server(image_dir)
+        base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+        from question_db import read_question_csv
+
+        results = []
+        try:
+            bench_fetch(results, base_url, image_names, args)
+            for name in args.csv:
+                src = Path(name) if Path(name).exists() else HERE / name
+                source = localize_links(read_question_csv(src), base_url, image_names)
+                for scale in args.scale:
+                    corpus_path = write_corpus(source, scale, work_dir / f"{src.stem}_x{scale}.csv")
+                    bench_corpus(results, src.stem, scale, corpus_path, args, work_dir)
+        finally:
+            server.shutdown()
+
+    report = {
+        "version": RESULT_VERSION,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "pandas": pd.__version__,
+            "git_commit": _git_commit(),
+        },
+        "params": {
+            "csv": args.csv,
+            "scale": args.scale,
+            "repeat": args.repeat,
+            "pdf_rows": args.pdf_rows,
+            "pdf_workers": args.pdf_workers,
+            "queries": args.queries,
+        },
+        "results": results,
+    }
+    Path(args.out).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"-> {args.out}", file=sys.stderr)
+
+    if args.baseline:
+        regressions = compare(results, Path(args.baseline), args.tolerance, args.min_delta)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+"""問題の出典（試験回・領域・問番号）の解析と、その並び順のインデックス。
+
+出典は問題文末尾のタグ（[97A1-ori]・[100A131-ori2]・[97A3] など）にしか無いので、
+取り込み時（question_db のスナップショット作成時）に型付きの列へ分解しておく。
+問題番号の列がある DB ではそちらを優先する。
+
+ExamIndex は試験回順の並びと、領域ごとの（回, 問番号）順の並びを持ち、
+「110-119c」（第110〜119回の C 領域）のような範囲を二分探索で引く。
+"""
+import re
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+# 取り込み時に追加する列（先頭が _ の列は書き出しに出ない）
+EXAM_COLUMN = "_exam"        # 試験回（不明なら 0）
+BLOCK_COLUMN = "_block"      # 領域（A〜D。不明なら ""）
+NUMBER_COLUMN = "_number"    # 問番号（不明なら 0）
+VARIANT_COLUMN = "_variant"  # 版（ori / ori2 など。無ければ ""）
+EXAM_ID_COLUMNS = [EXAM_COLUMN, BLOCK_COLUMN, NUMBER_COLUMN, VARIANT_COLUMN]
+
+# 問題文のタグ。全角の括弧（［119D1-ori］）・ハイフン抜け（[119A9ori]）の書き損じも拾う。
+# 問番号は4桁まで（image7559 は版を問番号の後ろの1桁で書く: [100A1312] = 100A131 の ori2）
+_TAG_RE = re.compile(r"[\[［]\s*(\d{2,3})\s*([A-D]{1,2})\s*(\d{1,4})\s*(?:-?\s*(ori\d*))?\s*[\]］]")
+# 開き括弧の抜けたタグ（image7559 の「… 101D5]」）は末尾にあるときだけ
+_TRAILING_TAG_RE = re.compile(r"(\d{2,3})([A-D])(\d{1,4})[\]］]\s*$")
+# 試験回ごとの領域 A〜D の問題数（97_119DB の収録から）。第111回以降は各 90 問
+_BLOCK_SIZES = {
+    97: (110, 75, 75, 70), 98: (105, 70, 70, 85), 99: (116, 77, 77, 95),
+    100: (150, 110, 50, 55), 101: (130, 130, 53, 52), 102: (130, 130, 53, 52),
+    103: (130, 53, 130, 52), 104: (130, 53, 130, 52), 105: (130, 53, 130, 52),
+    106: (130, 52, 130, 53), 107: (130, 52, 130, 53), 108: (130, 52, 130, 53),
+    109: (130, 52, 130, 53), 110: (130, 52, 130, 53),
+}
+_LATER_BLOCK_SIZE = 90
+# 収録している試験回（領域の無い「110-119」のような範囲は、両端がこの中のときだけ出典の指定とみなす）
+FIRST_EXAM, LAST_EXAM = 97, 119
+_MAX_BLOCK_SIZE = 150
+# 問題番号の列の値（118A1・118A1-ori など）
+_NUMBER_RE = re.compile(r"\s*(\d{2,3})\s*([A-D]{1,2})\s*(\d{1,3})\s*(?:-?\s*(ori\d*))?")
+# 検索語としての出典の指定（小文字化済み）。110-119c・118a・97a1・118a1-20 など
+_QUERY_RE = re.compile(r"(\d{2,3})(?:[-~〜–](\d{2,3}))?([a-d]+)?(?:(\d{1,3})(?:[-~〜–](\d{1,3}))?)?")
+
+
+class ExamId(NamedTuple):
+    exam: int
+    block: str
+    number: int
+    variant: str
+
+
+class ExamQuery(NamedTuple):
+    exam_lo: int
+    exam_hi: int
+    blocks: tuple[str, ...]       # 空なら全領域
+    number_lo: int | None = None
+    number_hi: int | None = None
+
+
+def parse_exam_id(text: str, number: str = "") -> ExamId | None:
+    """問題番号（あれば）か問題文のタグから出典を取り出す。複数タグがあれば先頭のもの。"""
+    m = _NUMBER_RE.match(number) if number else None
+    if m is None:
+        m = _TAG_RE.search(text) or _TRAILING_TAG_RE.search(text)
+    if m is None:
+        return None
+    exam, block, no = m.group(1, 2, 3)
+    variant = m.group(4) if m.re.groups >= 4 else None
+    exam = int(exam)
+    if not variant and len(no) > 1 and no[-1] in "2２" and int(no) > block_size(exam, block):
+        # 版の無いタグで問番号が領域の問題数を超え、末尾が 2 なら ori2（[101B282] = 101B28 の ori2）
+        no, variant = no[:-1], "ori2"
+    return ExamId(exam, block, int(no), variant or "")
+
+
+def block_size(exam: int, block: str) -> int:
+    """その回・領域の問題数（分からなければ最大の 150）"""
+    if exam > max(_BLOCK_SIZES):
+        return _LATER_BLOCK_SIZE
+    sizes = _BLOCK_SIZES.get(exam)
+    if sizes is None or block[:1] not in "ABCD":
+        return _MAX_BLOCK_SIZE
+    return sizes["ABCD".index(block[:1])]
+
+
+def strip_exam_tags(text: str) -> str:
+    """問題文から出典のタグを取り除く（DB ごとに書き方の違うタグを比較に持ち込まない）"""
+    return _TRAILING_TAG_RE.sub("", _TAG_RE.sub("", text))
+
+
+def format_exam_id(exam: int, block: str, number: int, variant: str = "") -> str:
+    """97A2-ori のような表記。出典が無ければ空文字"""
+    if not exam:
+        return ""
+    return f"{exam}{block}{number}" + (f"-{variant}" if variant else "")
+
+
+def exam_id_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """問題ごとの出典を EXAM_ID_COLUMNS の型付きの列にする（df と同じ index）"""
+    texts = df["問題文"].astype(str) if "問題文" in df.columns else pd.Series("", index=df.index)
+    numbers = df["問題番号"].astype(str) if "問題番号" in df.columns else pd.Series("", index=df.index)
+    ids = [parse_exam_id(t, n) or ExamId(0, "", 0, "") for t, n in zip(texts, numbers)]
+    exams, blocks, nos, variants = zip(*ids) if ids else ((), (), (), ())
+    return pd.DataFrame({
+        EXAM_COLUMN: np.asarray(exams, dtype=np.int16),
+        BLOCK_COLUMN: pd.Series(blocks, dtype=str),
+        NUMBER_COLUMN: np.asarray(nos, dtype=np.int16),
+        VARIANT_COLUMN: pd.Series(variants, dtype=str),
+    }).set_axis(df.index)
+
+
+def parse_exam_query(keyword: str) -> ExamQuery | None:
+    """検索語が出典の指定なら ExamQuery にする。
+
+    範囲か領域を含む語（110-119c・118a・97a1）だけを出典として扱い、
+    数字だけの語（118）はこれまでどおり部分一致で探す。
+    領域の無い範囲は両端が収録している回（FIRST_EXAM〜LAST_EXAM）のときだけで、
+    「10-20」（10-20歳 など）は部分一致の語のまま。
+    """
+    m = _QUERY_RE.fullmatch(keyword.replace(" ", ""))
+    if m is None:
+        return None
+    exam_lo, exam_hi, blocks, number_lo, number_hi = m.groups()
+    if exam_hi is None and blocks is None:
+        return None
+    if number_lo is not None and blocks is None:
+        return None
+    exam_lo = int(exam_lo)
+    exam_hi = int(exam_hi) if exam_hi is not None else exam_lo
+    if blocks is None and not all(FIRST_EXAM <= e <= LAST_EXAM for e in (exam_lo, exam_hi)):
+        return None
+    number_lo = int(number_lo) if number_lo is not None else None
+    number_hi = int(number_hi) if number_hi is not None else number_lo
+    return ExamQuery(
+        min(exam_lo, exam_hi), max(exam_lo, exam_hi),
+        tuple(sorted(set((blocks or "").upper()))),
+        number_lo, number_hi,
+    )
+
+
+class ExamIndex:
+    """出典の並び順。行番号は DataFrame の位置（iloc）。"""
+
+    def __init__(self, exams, blocks, numbers, variants):
+        self.exams = np.asarray(exams, dtype=np.int32)
+        self.numbers = np.asarray(numbers, dtype=np.int32)
+        blocks = np.asarray(blocks, dtype=object)
+        block_names, block_codes = np.unique(blocks, return_inverse=True)
+        _, variant_codes = np.unique(np.asarray(variants, dtype=object), return_inverse=True)
+
+        # 試験回順（回 → 領域 → 問番号 → 版 → 行番号）。出典の無い行は最後に回す
+        known = self.exams > 0
+        exam_keys = np.where(known, self.exams, np.iinfo(np.int32).max)
+        rows = np.arange(len(self.exams))
+        self.order = np.lexsort((rows, variant_codes, self.numbers, block_codes, exam_keys))
+        self.rank = np.empty_like(self.order)
+        self.rank[self.order] = rows
+        self._sorted_exams = exam_keys[self.order]
+
+        # 領域ごとの（回 → 問番号）順の行番号と、二分探索用のその回の並び
+        self._by_block = {}
+        for code, name in enumerate(block_names):
+            if not name:
+                continue
+            in_block = self.order[block_codes[self.order] == code]
+            self._by_block[name] = (in_block, self.exams[in_block])
+
+    def __len__(self):
+        return len(self.exams)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "ExamIndex":
+        """取り込み済みの列があればそれを、無ければ問題文から解析して作る"""
+        cols = df if all(c in df.columns for c in EXAM_ID_COLUMNS) else exam_id_columns(df)
+        return cls(
+            cols[EXAM_COLUMN].to_numpy(),
+            cols[BLOCK_COLUMN].to_numpy(dtype=object),
+            cols[NUMBER_COLUMN].to_numpy(),
+            cols[VARIANT_COLUMN].to_numpy(dtype=object),
+        )
+
+    def select(self, query: ExamQuery) -> np.ndarray:
+        """query に当たる行番号を昇順で返す。回の範囲は二分探索で切り出す。"""
+        if query.blocks:
+            parts = []
+            for block in query.blocks:
+                rows, exams = self._by_block.get(block, (np.empty(0, dtype=np.int64),) * 2)
+                lo, hi = np.searchsorted(exams, [query.exam_lo, query.exam_hi + 1])
+                parts.append(rows[lo:hi])
+            rows = np.concatenate(parts)
+        else:
+            lo, hi = np.searchsorted(self._sorted_exams, [query.exam_lo, query.exam_hi + 1])
+            rows = self.order[lo:hi]
+        if query.number_lo is not None:
+            numbers = self.numbers[rows]
+            rows = rows[(numbers >= query.number_lo) & (numbers <= query.number_hi)]
+        return np.sort(rows)
+
+    def sort(self, rows, descending: bool = False) -> np.ndarray:
+        """行番号を試験回順に並べる（descending なら新しい回から。出典の無い行はどちらも最後）"""
+        rows = np.asarray(rows, dtype=np.int64)
+        ranks = self.rank[rows]
+        if descending:
+            # 回は新しい順、同じ回の中は領域・問番号の昇順のまま
+            exams = np.where(self.exams[rows] > 0, -self.exams[rows], np.iinfo(np.int32).max)
+            return rows[np.lexsort((ranks, exams))]
+        return rows[np.argsort(ranks, kind="stable")]
@@ -0,0 +1,362 @@
+"""Google Drive 画像のディスクキャッシュ。
+
+Drive のファイルIDをキーに、取得済みの画像バイト列をディスクへ保存する。
+- 実体は内容の SHA-256 で保存（同じ画像は1つだけ持つ）
+- 合計サイズ上限を超えたら、最も長く使われていないものから削除（LRU）
+- 鮮度切れのものは ETag / Last-Modified で再検証（304 ならそのまま使う）
+- 通信は image_fetch.py（ホストごとの同時数制限・再試行・画像かどうかの確認）を通す
+- オフラインモードではネットワークに出ず、キャッシュ済みのものだけ返す
+- 事前に取得したミラー（image_mirror.py）にある画像は、ネットワークに出ずにそこから返す
+- 縮小・再圧縮した派生画像（PDF 用・一覧のサムネイル）も元画像ごとに保存し、元画像と一緒に消す。
+  派生画像の大きさも合計サイズに数え、ミラーの画像から作ったもの（元画像がキャッシュに無い）も使われていない順に消す
+
+環境変数:
+    IMAGE_CACHE_DIR       保存先（既定: このファイルと同じ場所の .image_cache）
+    IMAGE_CACHE_MAX_MB    合計サイズ上限 MB（既定: 1024）
+    IMAGE_CACHE_FRESH_H   再検証なしで使う時間（既定: 168 = 7日）
+    IMAGE_CACHE_OFFLINE   "1" でオフラインモード
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import requests
+
+from image_fetch import ImageFetchError, ImageFetcher, get_fetcher
+
+_DRIVE_ID_RE = re.compile(r"(?:/file/d/|[?&]id=)([A-Za-z0-9_-]+)")
+
+
+class ImageCacheMiss(LookupError):
+    """オフラインモードでキャッシュに無い画像を要求された。"""
+
+
+def drive_file_id(url: str) -> str | None:
+    """共有リンク（/file/d/<id>/）・直リンク（?id=<id>）どちらからでもIDを取り出す。"""
+    if not url or "drive.google.com" not in url:
+        return None
+    m = _DRIVE_ID_RE.search(url)
+    return m.group(1) if m else None
+
+
+def convert_google_drive_link(url):
+    """Drive の共有リンクを、画像本体を直接返す URL に変える。"""
+    if "drive.google.com" in url and "/file/d/" in url:
+        try:
+            file_id = url.split("/file/d/")[1].split("/")[0]
+            return f"https://drive.google.com/uc?export=view&id={file_id}"
+        except Exception:
+            return url
+    return url
+
+
+def cache_key(url: str) -> str:
+    """Drive の画像はファイルID、それ以外はURLのハッシュをキーにする。"""
+    file_id = drive_file_id(url)
+    if file_id:
+        return file_id
+    return "url-" + hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+
+class DriveImageCache:
+    def __init__(self, root, max_bytes: int, fresh_seconds: float, offline: bool = False,
+                 fetcher: ImageFetcher | None = None, mirror=None):
+        """fetcher を省略するとプロセス共通の取得器（image_fetch.get_fetcher）を使う。
+
+        mirror（image_mirror.ImageMirror）にある画像は、期限に関係なくそこから読む。
+        """
+        self.root = Path(root)
+        self.blob_dir = self.root / "blobs"
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        self.derived_dir = self.root / "derived"
+        self.derived_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.fresh_seconds = fresh_seconds
+        self.offline = offline
+        self.fetcher = fetcher
+        self.mirror = mirror
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.root / "index.sqlite3"), check_same_thread=False)
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                used_at REAL NOT NULL
+            )
+            """
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_used_at ON entries(used_at)")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS derivatives (
+                sha256 TEXT NOT NULL,
+                spec TEXT NOT NULL,
+                path TEXT NOT NULL,
+                width INTEGER NOT NULL,
+                height INTEGER NOT NULL,
+                size INTEGER NOT NULL DEFAULT 0,
+                used_at REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (sha256, spec)
+            )
+            """
+        )
+        # 大きさ・使用時刻の列が無い以前の索引には足す（既存の派生画像は大きさを測り直す）
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(derivatives)")}
+        if "size" not in columns:
+            self._db.execute("ALTER TABLE derivatives ADD COLUMN size INTEGER NOT NULL DEFAULT 0")
+            self._db.execute("ALTER TABLE derivatives ADD COLUMN used_at REAL NOT NULL DEFAULT 0")
+            for path, in self._db.execute("SELECT path FROM derivatives").fetchall():
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    size = 0
+                self._db.execute("UPDATE derivatives SET size = ? WHERE path = ?", (size, path))
+        self._db.execute("CREATE INDEX IF NOT EXISTS derivatives_used_at ON derivatives(used_at)")
+        self._db.commit()
+
+    # ---- 実体ファイル ----
+    def _blob_path(self, sha: str) -> Path:
+        return self.blob_dir / sha[:2] / sha
+
+    def _write_blob(self, data: bytes) -> str:
+        sha = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(sha)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f"{sha}.{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+        return sha
+
+    def _read_blob(self, sha: str) -> bytes | None:
+        try:
+            return self._blob_path(sha).read_bytes()
+        except OSError:
+            return None
+
+    # ---- 索引 ----
+    def _lookup(self, key: str):
+        with self._lock:
+            return self._db.execute(
+                "SELECT sha256, etag, last_modified, fetched_at FROM entries WHERE key = ?",
+                (key,),
+            ).fetchone()
+
+    def _touch(self, key: str, revalidated: bool = False):
+        now = time.time()
+        with self._lock:
+            if revalidated:
+                self._db.execute(
+                    "UPDATE entries SET used_at = ?, fetched_at = ? WHERE key = ?", (now, now, key)
+                )
+            else:
+                self._db.execute("UPDATE entries SET used_at = ? WHERE key = ?", (now, key))
+            self._db.commit()
+
+    def _store(self, key: str, data: bytes, etag: str | None, last_modified: str | None):
+        sha = self._write_blob(data)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, sha, len(data), etag, last_modified, now, now),
+            )
+            self._db.commit()
+            self._evict_locked()
+
+    def _total_bytes_locked(self) -> int:
+        """元画像（同じ実体は1つ）と派生画像の合計バイト数"""
+        row = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM (SELECT MAX(size) AS size FROM entries GROUP BY sha256)"
+        ).fetchone()
+        derived = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM derivatives").fetchone()
+        return int(row[0]) + int(derived[0])
+
+    def _evict_locked(self, keep: str | None = None):
+        """合計サイズが上限以下になるまで、元画像・派生画像を使われていない順に消す（keep の sha256 のものは残す）。"""
+        total = self._total_bytes_locked()
+        if total <= self.max_bytes:
+            return
+        # (使用時刻, 元画像のキー or None, sha256, 派生画像の spec or None)
+        rows = self._db.execute(
+            "SELECT used_at, key, sha256, NULL FROM entries"
+            " UNION ALL SELECT used_at, NULL, sha256, spec FROM derivatives"
+            " ORDER BY 1"
+        ).fetchall()
+        # 直近に保存したもの（最後の1件）は残す
+        for _, key, sha, spec in rows[:-1]:
+            if sha == keep:
+                continue
+            if key is None:
+                total -= self._drop_derivative_locked(sha, spec)
+            else:
+                self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                still_used = self._db.execute(
+                    "SELECT 1 FROM entries WHERE sha256 = ? LIMIT 1", (sha,)
+                ).fetchone()
+                if not still_used:
+                    try:
+                        size = self._blob_path(sha).stat().st_size
+                        self._blob_path(sha).unlink()
+                    except OSError:
+                        size = 0
+                    total -= size + self._drop_derivatives_locked(sha)
+            if total <= self.max_bytes:
+                break
+        self._db.commit()
+
+    # ---- 派生画像 ----
+    def _lookup_derivative(self, sha: str, spec: str):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT path, width, height FROM derivatives WHERE sha256 = ? AND spec = ?",
+                (sha, spec),
+            ).fetchone()
+            if row is None or not os.path.exists(row[0]):
+                return None
+            self._db.execute(
+                "UPDATE derivatives SET used_at = ? WHERE sha256 = ? AND spec = ?", (time.time(), sha, spec)
+            )
+            self._db.commit()
+        return row
+
+    def _drop_derivative_locked(self, sha: str, spec: str) -> int:
+        """派生画像を1つ消し、消したバイト数を返す"""
+        row = self._db.execute(
+            "SELECT path, size FROM derivatives WHERE sha256 = ? AND spec = ?", (sha, spec)
+        ).fetchone()
+        if row is None:
+            return 0
+        try:
+            os.unlink(row[0])
+        except OSError:
+            pass
+        self._db.execute("DELETE FROM derivatives WHERE sha256 = ? AND spec = ?", (sha, spec))
+        return row[1]
+
+    def _drop_derivatives_locked(self, sha: str) -> int:
+        """元画像から作った派生画像をすべて消し、消したバイト数を返す"""
+        specs = self._db.execute("SELECT spec FROM derivatives WHERE sha256 = ?", (sha,)).fetchall()
+        return sum(self._drop_derivative_locked(sha, spec) for spec, in specs)
+
+    def derivative(self, url: str, spec: str, make, timeout: float = 5, session=None) -> tuple[str, int, int]:
+        """url の画像から作った派生画像の (ファイル, 元画像の幅, 元画像の高さ) を返す。
+
+        spec は作り方（用途・大きさ・画質）を表す文字列。無ければ make(元のバイト列, 保存先) で作って覚える。
+        元画像が鮮度内で派生画像もあれば、元画像の実体は読まない。
+        """
+        key = cache_key(url)
+        mirrored = self.mirror.lookup(key) if self.mirror is not None else None
+        if mirrored is not None:
+            found = self._lookup_derivative(mirrored["sha256"], spec)
+            if found is not None:
+                return found
+        else:
+            entry = self._lookup(key)
+            if entry is not None and (self.offline or time.time() - entry[3] < self.fresh_seconds):
+                found = self._lookup_derivative(entry[0], spec)
+                if found is not None:
+                    self._touch(key)
+                    return found
+        data = self.fetch(url, timeout=timeout, session=session)
+        sha = hashlib.sha256(data).hexdigest()
+        found = self._lookup_derivative(sha, spec)
+        if found is not None:
+            return found
+        path, width, height = make(data, self.derived_dir)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = 0
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO derivatives (sha256, spec, path, width, height, size, used_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (sha, spec, str(path), width, height, size, time.time()),
+            )
+            self._db.commit()
+            # 今作った派生画像と、その元画像は返す前に消さない
+            self._evict_locked(keep=sha)
+        return str(path), width, height
+
+    # ---- 取得 ----
+    def fetch(self, url: str, timeout: float = 5, session=None) -> bytes:
+        """画像バイト列を返す。ミラーにあるか、キャッシュが新しければネットワークには出ない。"""
+        key = cache_key(url)
+        if self.mirror is not None:
+            data = self.mirror.read(key)
+            if data is not None:
+                return data
+            # ミラー作成時に取得できなかった画像は、書き出しのたびに再試行して待たせない
+            reason = self.mirror.failure(key)
+            if reason is not None:
+                raise ImageFetchError(url, f"ミラー作成時に失敗（{reason}）")
+        entry = self._lookup(key)
+        cached = self._read_blob(entry[0]) if entry else None
+
+        if cached is not None:
+            sha, etag, last_modified, fetched_at = entry
+            if self.offline or time.time() - fetched_at < self.fresh_seconds:
+                self._touch(key)
+                return cached
+            headers = {}
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+            try:
+                resp = self._http().get(url, timeout=timeout, headers=headers, session=session)
+            except requests.RequestException:
+                # 再検証に失敗したら（確認ページが返った場合も）手元の画像で続行する
+                self._touch(key)
+                return cached
+            if resp.status_code == 304:
+                self._touch(key, revalidated=True)
+                return cached
+            self._store(key, resp.content, resp.headers.get("ETag"), resp.headers.get("Last-Modified"))
+            return resp.content
+
+        if self.offline:
+            raise ImageCacheMiss(url)
+        # 画像でない応答・再試行しても失敗した場合は ImageFetchError
+        resp = self._http().get(url, timeout=timeout, session=session)
+        self._store(key, resp.content, resp.headers.get("ETag"), resp.headers.get("Last-Modified"))
+        return resp.content
+
+    def _http(self) -> ImageFetcher:
+        return self.fetcher or get_fetcher()
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def get_image_cache() -> DriveImageCache:
+    """環境変数の設定でプロセス共通のキャッシュを1つだけ作る。"""
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            from image_mirror import get_mirror  # image_mirror がこのモジュールを使うので、ここで読む
+
+            root = os.environ.get("IMAGE_CACHE_DIR") or Path(__file__).parent / ".image_cache"
+            _default_cache = DriveImageCache(
+                root,
+                max_bytes=int(float(os.environ.get("IMAGE_CACHE_MAX_MB", "1024")) * 1024 * 1024),
+                fresh_seconds=float(os.environ.get("IMAGE_CACHE_FRESH_H", "168")) * 3600,
+                offline=os.environ.get("IMAGE_CACHE_OFFLINE", "") == "1",
+                mirror=get_mirror(),
+            )
+        return _default_cache
+
+
+def fetch_image_bytes(url: str, timeout: float = 5, session=None) -> bytes:
+    return get_image_cache().fetch(url, timeout=timeout, session=session)
@@ -0,0 +1,68 @@
+"""縮小・再圧縮した派生画像（PDF 埋め込み用・検索結果のサムネイル）。
+
+元画像は画像キャッシュにそのまま置き、用途ごとに1つずつ派生画像を作って同じキャッシュに覚えておく
+（キーは Drive のファイルID、作り直しの判定は元画像の内容）。
+- PDF 用: A4 の本文幅・高さに収めた表示サイズで TARGET_DPI になる解像度（pdf_images.prepare_embed）
+- サムネイル: 検索結果の一覧に出す小さな画像
+2回目以降は元画像を読み込み・デコードせず、派生画像のファイルをそのまま使う。
+"""
+import hashlib
+import io
+from pathlib import Path
+
+from PIL import Image
+
+from image_cache import get_image_cache
+from pdf_images import JPEG_QUALITY, TARGET_DPI, EmbedImage, _write_atomic, prepare_embed
+
+# サムネイルの長辺（px）と画質
+THUMBNAIL_SIZE = 480
+THUMBNAIL_QUALITY = 80
+
+
+def embed_spec(max_width: float, max_height: float, dpi: int = TARGET_DPI) -> str:
+    return f"embed:{max_width:.2f}x{max_height:.2f}@{dpi}:q{JPEG_QUALITY}"
+
+
+def load_embed(url: str, max_width: float, max_height: float, dpi: int = TARGET_DPI,
+               timeout: float = 5, session=None) -> EmbedImage:
+    """PDF にそのまま埋め込める派生画像（無ければ作って覚える）"""
+    def make(data, work_dir):
+        return prepare_embed(data, work_dir, max_width=max_width, max_height=max_height, dpi=dpi)
+
+    path, width, height = get_image_cache().derivative(
+        url, embed_spec(max_width, max_height, dpi), make, timeout=timeout, session=session
+    )
+    return EmbedImage(path, width, height)
+
+
+def prepare_thumbnail(data: bytes, work_dir, size: int = THUMBNAIL_SIZE) -> EmbedImage:
+    """長辺 size 以下に縮小した JPEG（透過があれば PNG）を書き、元画像の大きさと返す。"""
+    im = Image.open(io.BytesIO(data))
+    iw, ih = im.size
+    has_alpha = im.mode in ("RGBA", "LA", "PA") or "transparency" in im.info
+    key = hashlib.sha256(data).hexdigest()
+    path = Path(work_dir) / f"{key}.thumb{size}.{'png' if has_alpha else 'jpg'}"
+    if not path.exists():
+        if im.format == "JPEG":
+            im.draft("RGB", (size, size))
+        im = im.convert("RGBA" if has_alpha else "RGB")
+        im.thumbnail((size, size), Image.LANCZOS)
+        buf = io.BytesIO()
+        if has_alpha:
+            im.save(buf, format="PNG", optimize=True)
+        else:
+            im.save(buf, format="JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+        _write_atomic(path, buf.getvalue())
+    return EmbedImage(str(path), iw, ih)
+
+
+def load_thumbnail(url: str, size: int = THUMBNAIL_SIZE, timeout: float = 5, session=None) -> EmbedImage:
+    """検索結果の一覧に出すサムネイル（無ければ作って覚える）"""
+    def make(data, work_dir):
+        return prepare_thumbnail(data, work_dir, size=size)
+
+    path, width, height = get_image_cache().derivative(
+        url, f"thumb:{size}:q{THUMBNAIL_QUALITY}", make, timeout=timeout, session=session
+    )
+    return EmbedImage(path, width, height)
@@ -0,0 +1,272 @@
+"""画像の HTTP 取得（asyncio で同時数を制御し、失敗は待って再試行する）。
+
+画像キャッシュ（image_cache.py）からの取得はすべてここを通る。
+- 通信は requests.Session（接続プール）をスレッドで使い、その割り振りを専用スレッドの
+  イベントループで行う。ホストごとの同時取得数に上限を設け、Drive に一度に押し寄せない
+- 429 / 5xx / タイムアウト / 接続エラーは指数バックオフ（Retry-After があればそれ）で再試行する
+- 200 でも画像でない応答（Drive の確認ページ HTML など）は失敗として扱う
+- 取得件数・再試行・失敗の内訳・バイト数を FetchMetrics に集計する
+
+環境変数:
+    IMAGE_FETCH_PER_HOST   ホストごとの同時取得数（既定: 4）
+    IMAGE_FETCH_RETRIES    再試行の回数（既定: 3）
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from functools import partial
+from typing import NamedTuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_PER_HOST = 4
+DEFAULT_MAX_CONNECTIONS = 16
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+# Content-Type が画像でも HTML でもない（octet-stream など）ときに見る先頭バイト
+_IMAGE_SIGNATURES = (b"\xff\xd8\xff", b"\x89PNG\r\n\x1a\n", b"GIF87a", b"GIF89a", b"BM", b"II*\x00", b"MM\x00*")
+
+
+class ImageFetchError(requests.RequestException):
+    """再試行しても画像を取得できなかった。reason は PDF などに出す短い理由。"""
+
+    def __init__(self, url: str, reason: str):
+        super().__init__(f"{reason}: {url}")
+        self.url = url
+        self.reason = reason
+
+
+class RetryPolicy(NamedTuple):
+    retries: int = 3
+    base_delay: float = 0.5
+    max_delay: float = 8.0
+
+    def delay(self, attempt: int, retry_after: float | None = None) -> float:
+        """attempt 回目（0始まり）の失敗のあとに待つ秒数"""
+        if retry_after is not None:
+            return min(max(retry_after, 0.0), self.max_delay)
+        # 全員が同時に再試行しないよう、半分〜等倍の範囲でばらつかせる
+        return min(self.base_delay * 2 ** attempt, self.max_delay) * random.uniform(0.5, 1.0)
+
+
+class FetchMetrics:
+    """取得の集計（スレッドをまたいで読めるようロックで守る）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.ok = 0
+        self.not_modified = 0
+        self.retries = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.failures = Counter()
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def fail(self, reason: str):
+        with self._lock:
+            self.failures[reason] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "ok": self.ok,
+                "not_modified": self.not_modified,
+                "retries": self.retries,
+                "failed": sum(self.failures.values()),
+                "failures": dict(self.failures),
+                "bytes": self.bytes,
+                "seconds": round(self.seconds, 3),
+            }
+
+
+def metrics_since(before: dict, after: dict) -> dict:
+    """snapshot 2つの差（ある処理の間だけの集計）"""
+    diff = {k: after[k] - before[k] for k in after if k != "failures"}
+    diff["seconds"] = round(diff["seconds"], 3)
+    diff["failures"] = {
+        reason: n - before["failures"].get(reason, 0)
+        for reason, n in after["failures"].items()
+        if n - before["failures"].get(reason, 0)
+    }
+    return diff
+
+
+def fetch_summary(metrics: dict) -> str:
+    """snapshot（または metrics_since の差）を画面に出す1行にする"""
+    text = f"画像の取得: {metrics['ok']}件（再検証 {metrics['not_modified']}件・再試行 {metrics['retries']}回）"
+    if metrics["failed"]:
+        reasons = "、".join(f"{reason} {n}件" for reason, n in metrics["failures"].items())
+        text += f" / 取得できなかった画像: {metrics['failed']}件（{reasons}）"
+    return text
+
+
+def _retry_after(resp) -> float | None:
+    value = resp.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return parsedate_to_datetime(value).timestamp() - time.time()
+    except (TypeError, ValueError):
+        return None
+
+
+def _check_image(url: str, resp):
+    """200 の応答が画像かどうかを Content-Type（無い・曖昧なら先頭バイト）で確かめる。"""
+    content_type = resp.headers.get("Content-Type", "").split(";")[0].strip().lower()
+    if content_type.startswith("image/"):
+        return
+    if content_type.startswith("text/html"):
+        raise ImageFetchError(url, "画像ではなく HTML（確認ページ）")
+    head = resp.content[:12]
+    if head.startswith(_IMAGE_SIGNATURES) or (head[:4] == b"RIFF" and head[8:12] == b"WEBP"):
+        return
+    raise ImageFetchError(url, f"画像ではない応答（{content_type or '種類不明'}）")
+
+
+def describe_fetch_error(e: BaseException) -> str:
+    """PDF の「画像読み込み失敗」に添える短い理由"""
+    if isinstance(e, ImageFetchError):
+        return e.reason
+    if isinstance(e, requests.Timeout):
+        return "タイムアウト"
+    if isinstance(e, requests.ConnectionError):
+        return "接続できない"
+    if isinstance(e, LookupError):
+        return "オフラインでキャッシュに無い"
+    if isinstance(e, OSError) or type(e).__name__ == "UnidentifiedImageError":
+        return "画像として読めない"
+    return type(e).__name__
+
+
+class ImageFetcher:
+    """ホストごとの同時数制限・再試行付きの取得。
+
+    async の fetch はイベントループから、get は任意のスレッドから呼べる
+    （get は専用スレッドのイベントループへ処理を渡して結果を待つ）。
+    """
+
+    def __init__(self, session: requests.Session | None = None, per_host: int = DEFAULT_PER_HOST,
+                 max_connections: int = DEFAULT_MAX_CONNECTIONS, policy: RetryPolicy = RetryPolicy()):
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_connections)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+        self.session = session
+        self.per_host = per_host
+        self.policy = policy
+        self.metrics = FetchMetrics()
+        self._executor = ThreadPoolExecutor(max_workers=max_connections, thread_name_prefix="img-fetch")
+        self._host_limits: dict[tuple, asyncio.Semaphore] = {}
+        self._loop = None
+        self._loop_lock = threading.Lock()
+
+    def _host_limit(self, url: str) -> asyncio.Semaphore:
+        # Semaphore はイベントループごとに作る（get が使う専用ループと、asyncio.run で回すループ）
+        key = (asyncio.get_running_loop(), urlsplit(url).netloc)
+        limit = self._host_limits.get(key)
+        if limit is None:
+            limit = self._host_limits.setdefault(key, asyncio.Semaphore(self.per_host))
+        return limit
+
+    async def fetch(self, url: str, timeout: float = 5, headers=None, session=None) -> requests.Response:
+        """画像の応答（200 か 304）を返す。取得できなければ ImageFetchError。"""
+        loop = asyncio.get_running_loop()
+        get = partial((session or self.session).get, url, timeout=timeout, headers=headers)
+        attempt = 0
+        while True:
+            retry_after = None
+            async with self._host_limit(url):
+                started = time.perf_counter()
+                try:
+                    resp = await loop.run_in_executor(self._executor, get)
+                    error = None
+                except (requests.Timeout, requests.ConnectionError) as e:
+                    resp, error = None, e
+                self.metrics.add(requests=1, seconds=time.perf_counter() - started)
+            if resp is not None:
+                if resp.status_code == 304:
+                    self.metrics.add(not_modified=1)
+                    return resp
+                if resp.ok:
+                    try:
+                        _check_image(url, resp)
+                    except ImageFetchError as e:
+                        self.metrics.fail(e.reason)
+                        raise
+                    self.metrics.add(ok=1, bytes=len(resp.content))
+                    return resp
+                if resp.status_code not in RETRY_STATUSES:
+                    self.metrics.fail(f"HTTP {resp.status_code}")
+                    raise ImageFetchError(url, f"HTTP {resp.status_code}")
+                retry_after = _retry_after(resp)
+            if attempt >= self.policy.retries:
+                reason = describe_fetch_error(error) if error is not None else f"HTTP {resp.status_code}"
+                self.metrics.fail(reason)
+                raise ImageFetchError(url, reason) from error
+            self.metrics.add(retries=1)
+            await asyncio.sleep(self.policy.delay(attempt, retry_after))
+            attempt += 1
+
+    async def fetch_many(self, urls, timeout: float = 5) -> list:
+        """urls と同じ順に (応答 or None, 例外 or None) を返す。"""
+        async def one(url):
+            try:
+                return await self.fetch(url, timeout=timeout), None
+            except requests.RequestException as e:
+                return None, e
+        return await asyncio.gather(*(one(url) for url in urls))
+
+    # ---- スレッドからの利用 ----
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._loop_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="img-fetch-loop", daemon=True).start()
+                self._loop = loop
+            return self._loop
+
+    def get(self, url: str, timeout: float = 5, headers=None, session=None) -> requests.Response:
+        """fetch の同期版（イベントループのスレッドの外から呼ぶ）"""
+        future = asyncio.run_coroutine_threadsafe(
+            self.fetch(url, timeout=timeout, headers=headers, session=session), self._ensure_loop()
+        )
+        return future.result()
+
+    def get_many(self, urls, timeout: float = 5) -> list:
+        """fetch_many の同期版"""
+        future = asyncio.run_coroutine_threadsafe(self.fetch_many(urls, timeout=timeout), self._ensure_loop())
+        return future.result()
+
+
+_default_fetcher = None
+_default_lock = threading.Lock()
+
+
+def get_fetcher() -> ImageFetcher:
+    """環境変数の設定でプロセス共通の取得器を1つだけ作る。"""
+    global _default_fetcher
+    with _default_lock:
+        if _default_fetcher is None:
+            _default_fetcher = ImageFetcher(
+                per_host=int(os.environ.get("IMAGE_FETCH_PER_HOST", DEFAULT_PER_HOST)),
+                policy=RetryPolicy(retries=int(os.environ.get("IMAGE_FETCH_RETRIES", "3"))),
+            )
+        return _default_fetcher
@@ -0,0 +1,229 @@
+"""問題DB の画像をまとめて取得するローカルミラー。
+
+全 CSV の画像リンクを集めて Drive のファイルIDで重複を除き、並列に取得して
+ミラーのディレクトリへ保存する。manifest.json に ID ごとの
+（元の URL, ファイル, 幅・高さ, バイト数, SHA-256, 状態, 失敗の理由）を記録する。
+画像キャッシュ（image_cache.py）はミラーにある画像をネットワークに出ずに返すので、
+本番の PDF 作成が画像の取得で止まらない。
+
+    python image_mirror.py                          # 97_119DB / 97_118DB / image7559 をすべて
+    python image_mirror.py image7559.csv --retry-failed
+    python image_mirror.py --dry-run                # 件数だけ数える
+
+取得できなかった画像が残っていれば終了コード 1。
+
+環境変数:
+    IMAGE_MIRROR_DIR   ミラーの場所（既定: このファイルと同じ場所の .image_mirror）
+"""
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+from PIL import Image
+
+from image_cache import cache_key, convert_google_drive_link
+from image_fetch import ImageFetcher, RetryPolicy, describe_fetch_error, fetch_summary
+from question_db import IMAGE_LINK_KEYS, load_questions, safe_get
+
+MANIFEST_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+DEFAULT_CSVS = ["97_119DB.csv", "97_118DB.csv", "image7559.csv"]
+# この件数ごとに取得して manifest を書く（途中で止めても次回はその続きから）
+BATCH_SIZE = 64
+
+
+def mirror_dir() -> Path:
+    return Path(os.environ.get("IMAGE_MIRROR_DIR") or Path(__file__).parent / ".image_mirror")
+
+
+def collect_links(csv_paths) -> dict[str, str]:
+    """全 CSV の画像リンクを、キャッシュのキー（Drive のファイルID）→ 取得用 URL にまとめる"""
+    links = {}
+    for path in csv_paths:
+        for row in load_questions(path).to_dict("records"):
+            link = safe_get(row, IMAGE_LINK_KEYS)
+            if not link.startswith(("http://", "https://")):
+                continue
+            url = convert_google_drive_link(link)
+            links.setdefault(cache_key(url), url)
+    return links
+
+
+class ImageMirror:
+    """ミラーのディレクトリと manifest。キーは image_cache.cache_key と同じ。"""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.entries: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        try:
+            data = json.loads((self.root / MANIFEST_NAME).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            data = None
+        if isinstance(data, dict) and data.get("version") == MANIFEST_VERSION:
+            self.entries = data.get("images", {})
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, key: str) -> dict | None:
+        """取得済み（状態 ok）の項目"""
+        entry = self.entries.get(key)
+        if entry is None or entry["status"] != "ok":
+            return None
+        return entry
+
+    def failure(self, key: str) -> str | None:
+        """ミラー作成時に取得できなかった画像なら、その理由"""
+        entry = self.entries.get(key)
+        if entry is None or entry["status"] == "ok":
+            return None
+        return entry["error"] or entry["status"]
+
+    def path(self, entry: dict) -> Path:
+        return self.root / entry["path"]
+
+    def read(self, key: str) -> bytes | None:
+        entry = self.lookup(key)
+        if entry is None:
+            return None
+        try:
+            return self.path(entry).read_bytes()
+        except OSError:
+            return None
+
+    def add(self, key: str, url: str, data: bytes):
+        """画像を保存し、manifest の項目を ok にする。画像として読めなければ broken。"""
+        sha = hashlib.sha256(data).hexdigest()
+        try:
+            im = Image.open(io.BytesIO(data))
+            width, height = im.size
+            ext = (im.format or "img").lower().replace("jpeg", "jpg")
+        except Exception as e:
+            self.fail(key, url, "broken", describe_fetch_error(e))
+            return
+        rel = f"{key[:2]}/{key}.{ext}"
+        path = self.root / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        with self._lock:
+            self.entries[key] = {
+                "url": url, "path": rel, "width": width, "height": height,
+                "bytes": len(data), "sha256": sha, "status": "ok", "error": None,
+                "fetched_at": round(time.time()),
+            }
+
+    def fail(self, key: str, url: str, status: str, reason: str):
+        with self._lock:
+            previous = self.entries.get(key)
+            # 以前取得できた画像は、今回失敗しても残す
+            if previous is not None and previous["status"] == "ok":
+                return
+            self.entries[key] = {
+                "url": url, "path": None, "width": None, "height": None,
+                "bytes": None, "sha256": None, "status": status, "error": reason,
+                "fetched_at": round(time.time()),
+            }
+
+    def save(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self.root / MANIFEST_NAME
+        tmp = path.with_suffix(".tmp")
+        with self._lock:
+            text = json.dumps({"version": MANIFEST_VERSION, "images": self.entries},
+                              ensure_ascii=False, indent=1, sort_keys=True)
+        tmp.write_text(text, encoding="utf-8")
+        tmp.replace(path)
+
+    def pending(self, links: dict[str, str], retry_failed: bool = False, refresh: bool = False) -> dict[str, str]:
+        """まだ取得していない（指定があれば失敗したもの・全部も）キー → URL"""
+        if refresh:
+            return dict(links)
+        todo = {}
+        for key, url in links.items():
+            entry = self.entries.get(key)
+            if entry is None or (entry["status"] == "ok" and not self.path(entry).exists()):
+                todo[key] = url
+            elif retry_failed and entry["status"] != "ok":
+                todo[key] = url
+        return todo
+
+
+async def _mirror(mirror: ImageMirror, todo: dict[str, str], fetcher: ImageFetcher, timeout: float):
+    items = list(todo.items())
+    for start in range(0, len(items), BATCH_SIZE):
+        batch = items[start:start + BATCH_SIZE]
+        results = await fetcher.fetch_many([url for _, url in batch], timeout=timeout)
+        for (key, url), (resp, error) in zip(batch, results):
+            if resp is None:
+                mirror.fail(key, url, "failed", describe_fetch_error(error))
+            else:
+                mirror.add(key, url, resp.content)
+        mirror.save()
+        print(f"{min(start + BATCH_SIZE, len(items))}/{len(items)}", file=sys.stderr)
+
+
+def build_mirror(csv_paths, root=None, retry_failed: bool = False, refresh: bool = False,
+                 per_host: int = 8, timeout: float = 30, dry_run: bool = False) -> tuple[ImageMirror, dict]:
+    """CSV の画像をミラーへ取得する。(ミラー, 取得の集計) を返す。"""
+    links = collect_links(csv_paths)
+    mirror = ImageMirror(root or mirror_dir())
+    todo = mirror.pending(links, retry_failed=retry_failed, refresh=refresh)
+    print(f"画像リンク {len(links)}件（取得済み {len(links) - len(todo)}件・これから {len(todo)}件）", file=sys.stderr)
+    fetcher = ImageFetcher(per_host=per_host, max_connections=per_host * 2, policy=RetryPolicy(retries=5))
+    if todo and not dry_run:
+        asyncio.run(_mirror(mirror, todo, fetcher, timeout))
+    return mirror, fetcher.metrics.snapshot()
+
+
+_default_mirror = None
+_default_lock = threading.Lock()
+
+
+def get_mirror() -> ImageMirror | None:
+    """ミラー（manifest があるときだけ）をプロセスで1つだけ読み込む。"""
+    global _default_mirror
+    with _default_lock:
+        if _default_mirror is None:
+            root = mirror_dir()
+            if not (root / MANIFEST_NAME).exists():
+                return None
+            _default_mirror = ImageMirror(root)
+        return _default_mirror
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("csv", nargs="*", default=DEFAULT_CSVS, help="画像リンクを集める CSV")
+    parser.add_argument("--out", help="ミラーの場所（既定: IMAGE_MIRROR_DIR か .image_mirror）")
+    parser.add_argument("--retry-failed", action="store_true", help="前回失敗した画像も取得し直す")
+    parser.add_argument("--refresh", action="store_true", help="取得済みの画像もすべて取得し直す")
+    parser.add_argument("--per-host", type=int, default=8, help="ホストごとの同時取得数")
+    parser.add_argument("--timeout", type=float, default=30, help="1件あたりのタイムアウト（秒）")
+    parser.add_argument("--dry-run", action="store_true", help="件数を数えるだけで取得しない")
+    args = parser.parse_args(argv)
+
+    mirror, metrics = build_mirror(
+        args.csv, root=args.out, retry_failed=args.retry_failed, refresh=args.refresh,
+        per_host=args.per_host, timeout=args.timeout, dry_run=args.dry_run,
+    )
+    if metrics["requests"]:
+        print(fetch_summary(metrics), file=sys.stderr)
+    statuses = {}
+    for entry in mirror.entries.values():
+        statuses[entry["status"]] = statuses.get(entry["status"], 0) + 1
+    print(f"{mirror.root / MANIFEST_NAME}: {len(mirror)}件 {statuses}", file=sys.stderr)
+    return 1 if statuses.get("failed") or statuses.get("broken") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,76 @@
+"""PDF 作成用の画像先読み。
+
+レイアウトのループより先に、先の行の画像を少数のスレッドで取得・デコードしておく。
+結果は必ず入力と同じ順番で返すので、描画順（ページ先頭は必ず問題文から）は変わらない。
+"""
+import io
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from image_cache import fetch_image_bytes
+
+DEFAULT_WORKERS = 8
+DEFAULT_LOOKAHEAD = 32
+
+
+def load_image(url: str, timeout: float = 5, prepare=None):
+    """取得（キャッシュ経由。通信は image_fetch の Session を使う）と下ごしらえをまとめて行う。
+
+    prepare を渡すとバイト列をそれで変換した結果を、渡さなければ RGB の PIL 画像を返す。
+    """
+    data = fetch_image_bytes(url, timeout=timeout)
+    if prepare is not None:
+        return prepare(data)
+    return Image.open(io.BytesIO(data)).convert("RGB")
+
+
+def prefetch_images(urls, max_workers: int = DEFAULT_WORKERS,
+                    lookahead: int = DEFAULT_LOOKAHEAD, timeout: float = 5, prepare=None, load=None):
+    """urls と同じ順に (画像 or None, 例外 or None) を返すジェネレータ。
+
+    画像は load_image の戻り値（prepare 指定時はその結果、無ければ RGB の PIL 画像）。
+    load を渡すと load_image の代わりに load(url, timeout=...) の戻り値を返す。
+
+    空の URL には (None, None) を返す。同じ URL は1回だけ取得する。
+    先読みは lookahead 件までなので、保持するデコード済み画像の数も抑えられる。
+    """
+    urls = iter(urls)
+    pending = deque()
+    in_flight = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="img-prefetch") as pool:
+        def submit_next() -> bool:
+            try:
+                url = next(urls)
+            except StopIteration:
+                return False
+            if not url:
+                pending.append((url, None))
+                return True
+            fut = in_flight.get(url)
+            if fut is None:
+                if load is not None:
+                    fut = pool.submit(load, url, timeout=timeout)
+                else:
+                    fut = pool.submit(load_image, url, timeout, prepare)
+                in_flight[url] = fut
+            pending.append((url, fut))
+            return True
+
+        while len(pending) < lookahead and submit_next():
+            pass
+
+        while pending:
+            url, fut = pending.popleft()
+            submit_next()
+            if fut is None:
+                yield None, None
+                continue
+            if not any(u == url for u, _ in pending):
+                in_flight.pop(url, None)
+            try:
+                yield fut.result(), None
+            except Exception as e:
+                yield None, e
@@ -0,0 +1,148 @@
+"""文字 n-gram（2-gram / 3-gram）の転置インデックス。
+
+日本語は単語の区切りが無いので、検索用テキストを文字単位の 2-gram・3-gram に分けて
+「その n-gram を含む行番号の一覧（ポスティングリスト）」を作っておく。
+AND 検索は各語の n-gram のポスティングリストを積集合で絞り込み、
+最後に候補行だけ実際の部分一致で確かめる（n-gram が揃っていても連続しているとは限らないため）。
+
+インデックスはディスクへ保存でき、元テキストのハッシュが変わらなければ再利用する。
+"""
+import hashlib
+import pickle
+from array import array
+from pathlib import Path
+
+# 保存形式を変えたら上げる（古い保存ファイルを無視させるため）
+INDEX_VERSION = 1
+NGRAM_SIZES = (2, 3)
+
+
+def texts_fingerprint(texts) -> str:
+    h = hashlib.sha256(f"v{INDEX_VERSION}:{NGRAM_SIZES}".encode("utf-8"))
+    for t in texts:
+        h.update(t.encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+class NgramIndex:
+    def __init__(self, texts, postings: dict, fingerprint: str):
+        self.texts = texts
+        self.postings = postings
+        self.fingerprint = fingerprint
+
+    def __len__(self):
+        return len(self.texts)
+
+    @classmethod
+    def build(cls, texts) -> "NgramIndex":
+        """texts はすでに小文字化などの正規化を済ませた検索用テキスト。"""
+        texts = [str(t) for t in texts]
+        postings = {}
+        for doc_id, text in enumerate(texts):
+            grams = set()
+            for n in NGRAM_SIZES:
+                for i in range(len(text) - n + 1):
+                    grams.add(text[i:i + n])
+            for g in grams:
+                ids = postings.get(g)
+                if ids is None:
+                    ids = postings[g] = array("I")
+                # 行番号の昇順に追加されるので、並べ替えは不要
+                ids.append(doc_id)
+        return cls(texts, postings, texts_fingerprint(texts))
+
+    # ---- 保存・読み込み ----
+    def save(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        with open(tmp, "wb") as f:
+            pickle.dump(
+                {"version": INDEX_VERSION, "fingerprint": self.fingerprint,
+                 "texts": self.texts, "postings": self.postings},
+                f,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path, fingerprint: str | None = None) -> "NgramIndex | None":
+        """保存済みインデックスを読む。形式違い・ハッシュ違い・破損なら None。"""
+        try:
+            with open(path, "rb") as f:
+                data = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            return None
+        if not isinstance(data, dict) or data.get("version") != INDEX_VERSION:
+            return None
+        if fingerprint is not None and data.get("fingerprint") != fingerprint:
+            return None
+        return cls(data["texts"], data["postings"], data["fingerprint"])
+
+    @classmethod
+    def load_or_build(cls, texts, path) -> "NgramIndex":
+        texts = [str(t) for t in texts]
+        fingerprint = texts_fingerprint(texts)
+        index = cls.load(path, fingerprint)
+        if index is None:
+            index = cls.build(texts)
+            try:
+                index.save(path)
+            except OSError:
+                pass  # 書き込めない環境でもメモリ上のインデックスで動かす
+        return index
+
+    # ---- 検索 ----
+    def keyword_grams(self, kw: str) -> set[str]:
+        """語の検索に使う n-gram。長い語ほど選択性の高い 3-gram を使う。"""
+        n = max((s for s in NGRAM_SIZES if s <= len(kw)), default=0)
+        if n == 0:
+            return set()
+        return {kw[i:i + n] for i in range(len(kw) - n + 1)}
+
+    def document_frequency(self, term: str) -> int:
+        """term を含む行の数（n-gram ならポスティングリストの長さ、それ以外は数えて求める）"""
+        if len(term) in NGRAM_SIZES:
+            return len(self.postings.get(term, ()))
+        return len(self.search([term]))
+
+    def candidates(self, keywords) -> set[int] | None:
+        """全語の n-gram をすべて含む行番号の集合。絞り込めない（1文字語のみ等）なら None。"""
+        lists = []
+        for kw in keywords:
+            for g in self.keyword_grams(kw):
+                ids = self.postings.get(g)
+                if ids is None:
+                    return set()
+                lists.append(ids)
+        if not lists:
+            return None
+        lists.sort(key=len)
+        result = set(lists[0])
+        for ids in lists[1:]:
+            result.intersection_update(ids)
+            if not result:
+                break
+        return result
+
+    def search(self, keywords) -> list[int]:
+        """すべての語を部分文字列として含む行番号を昇順で返す（AND 検索）。"""
+        keywords = [kw for kw in keywords if kw]
+        if not keywords:
+            return list(range(len(self.texts)))
+        cand = self.candidates(keywords)
+        rows = range(len(self.texts)) if cand is None else sorted(cand)
+        texts = self.texts
+        return [i for i in rows if all(kw in texts[i] for kw in keywords)]
+
+    def refine(self, rows, keywords) -> list[int]:
+        """rows（昇順の行番号）のうち、すべての語を含む行だけを返す。"""
+        keywords = [kw for kw in keywords if kw]
+        if not keywords:
+            return list(rows)
+        cand = self.candidates(keywords)
+        if cand is not None:
+            rows = [i for i in rows if i in cand]
+        texts = self.texts
+        return [i for i in rows if all(kw in texts[i] for kw in keywords)]
@@ -0,0 +1,490 @@
+"""画像付き PDF の作成（Streamlit に依存しない）。
+
+ページ先頭は必ず問題文から／画像は必ず表示、という従来のレイアウト規則のまま、
+- create_pdf: 1プロセスで順に描画する
+- create_pdf_parallel: 件数が多いときに、ページ単位で区切った塊を複数プロセスで描画して結合する
+を提供する。どちらも1問ずつ描画位置まで決めた Fragment を作ってからページに詰めて描く。
+Fragment は pdf_fragments.py で DB の全問題について事前に作っておける（その問題はレイアウトし直さない）。
+フォント登録はこのモジュールの読み込み時に行うので、
+子プロセスでも同じフォント・同じ文字幅で描画される。
+"""
+import io
+import os
+import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from functools import partial
+from multiprocessing import get_context
+from pathlib import Path
+from queue import Empty
+from typing import NamedTuple
+
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.cidfonts import UnicodeCIDFont
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+from image_cache import convert_google_drive_link
+from image_derivatives import load_embed
+from image_fetch import describe_fetch_error
+from image_prefetch import prefetch_images
+from pdf_images import display_size, prepare_embed
+from question_db import (
+    ANSWER_KEYS,
+    CATEGORY_KEYS,
+    IMAGE_LINK_KEYS,
+    NUMBER_KEYS,
+    QUESTION_KEYS,
+    repair_known_mojibake,
+    safe_get,
+)
+from text_layout import TextLayout
+
+# ---- フォント設定（IPAex を優先、無ければCIDフォントへフォールバック）----
+def _setup_font():
+    here = Path(__file__).parent
+    candidates = [
+        here / "fonts" / "IPAexGothic.ttf",
+        here / "IPAexGothic.ttf",
+        Path.cwd() / "fonts" / "IPAexGothic.ttf",
+        Path.cwd() / "IPAexGothic.ttf",
+    ]
+    for p in candidates:
+        if p.exists():
+            pdfmetrics.registerFont(TTFont("Japanese", str(p)))
+            return "Japanese"
+    pdfmetrics.registerFont(UnicodeCIDFont("HeiseiKakuGo-W5"))
+    return "HeiseiKakuGo-W5"
+
+JAPANESE_FONT = _setup_font()
+
+# ---- 追加フォント（アラビア文字など日本語フォントに無い文字用のフォールバック）----
+def _setup_fallback_font():
+    here = Path(__file__).parent
+    candidates = [
+        here / "fonts" / "Unifont.otf",
+        here / "fonts" / "DejaVuSans.ttf",
+        Path.cwd() / "fonts" / "Unifont.otf",
+        Path.cwd() / "fonts" / "DejaVuSans.ttf",
+    ]
+    for i, p in enumerate(candidates):
+        if p.exists():
+            try:
+                name = f"Fallback{i}"
+                pdfmetrics.registerFont(TTFont(name, str(p)))
+                return name
+            except Exception:
+                continue
+    return None
+
+FALLBACK_FONT = _setup_fallback_font()
+
+# ---- 歯式記号専用フォント ----
+def _setup_symbol_font():
+    here = Path(__file__).parent
+    candidates = [
+        here / "fonts" / "NotoSansSymbols2-Regular.ttf",
+        Path.cwd() / "fonts" / "NotoSansSymbols2-Regular.ttf",
+    ]
+    for p in candidates:
+        if p.exists():
+            try:
+                pdfmetrics.registerFont(TTFont("DentalSymbols", str(p)))
+                return "DentalSymbols"
+            except Exception:
+                continue
+    return FALLBACK_FONT
+
+SYMBOL_FONT = _setup_symbol_font()
+
+# ---- アラビア文字の連結表示・右→左の表示順を補正 ----
+try:
+    import arabic_reshaper
+    from bidi.algorithm import get_display as _bidi_display
+except ImportError:
+    arabic_reshaper = None
+    _bidi_display = None
+
+_ARABIC_RE = re.compile(r'[؀-ۿݐ-ݿࢠ-ࣿﭐ-﷿ﹰ-﻿]')
+_DENTISTRY_SYMBOLS = frozenset("⎾⎿⏉⏊⏋⏌")
+_BIDI_CONTROL_RE = re.compile(r"[\u200e\u200f\u202a-\u202e\u2066-\u2069\ufeff]")
+
+def _sanitize_pdf_text(text: str) -> str:
+    """歯式の並びを崩す不可視の方向制御文字をPDF描画前に除去する。"""
+    return _BIDI_CONTROL_RE.sub("", repair_known_mojibake(text))
+
+# 文字ごとのフォント振り分けと文字幅はキャッシュして使い回す
+LAYOUT = TextLayout(
+    JAPANESE_FONT,
+    fallback=FALLBACK_FONT,
+    symbol=SYMBOL_FONT,
+    symbol_chars=_DENTISTRY_SYMBOLS,
+    fallback_re=_ARABIC_RE,
+)
+
+def _font_for_character(ch: str) -> str:
+    return LAYOUT.font_for(ch)
+
+def _shape_arabic(text: str) -> str:
+    """アラビア文字が含まれる場合のみ、文字の連結（reshape）と表示順（bidi）を整える"""
+    if not text or arabic_reshaper is None or not _ARABIC_RE.search(text):
+        return text
+    try:
+        return _bidi_display(arabic_reshaper.reshape(text))
+    except Exception:
+        return text
+
+def _split_font_runs(text: str):
+    """各文字を収録フォントへ振り分け、連続する同一フォントをまとめる。"""
+    return LAYOUT.split_runs(_sanitize_pdf_text(text))
+
+def _text_width(text: str, font_size: int) -> float:
+    return LAYOUT.text_width(_sanitize_pdf_text(text), font_size)
+
+def wrap_text(text: str, max_width: float, font_name: str, font_size: int):
+    # 1文字ずつ幅を足していく（キャッシュ済みの文字幅を使うので文字数に比例）
+    return LAYOUT.wrap(text, max_width, font_size)
+
+def wrapped_lines(prefix: str, value: str, usable_width: float, font: str, size: int):
+    clean_value = _sanitize_pdf_text(value)
+    return wrap_text(f"{prefix}{_shape_arabic(clean_value)}", usable_width, font, size)
+
+# ===== ページ設定 =====
+PAGE_WIDTH, PAGE_HEIGHT = A4
+TOP_MARGIN, BOTTOM_MARGIN = 40, 60
+LEFT_MARGIN, RIGHT_MARGIN = 40, 40
+USABLE_WIDTH = PAGE_WIDTH - LEFT_MARGIN - RIGHT_MARGIN
+PAGE_USABLE_H = (PAGE_HEIGHT - TOP_MARGIN) - BOTTOM_MARGIN
+LINE_H = 18
+
+# これ未満の件数では並列化しない（子プロセスの起動の方が高くつく）
+PARALLEL_MIN_RECORDS = 300
+
+
+def _embed_url(link: str) -> str:
+    return convert_google_drive_link(link) if link else ""
+
+
+def prefetch_embed_images(records, work_dir=None, links=None):
+    """records と同じ順に (埋め込み用画像 or None, 例外 or None) を返す。
+
+    埋め込み用画像は画像キャッシュの派生画像（縮小済み）を使い、無ければ作って覚える。
+    work_dir を渡すと、代わりにそこへ作る（キャッシュの掃除で消えてほしくない場合）。
+    links（records と同じ順の画像リンク）を渡すとそれを使う。空のリンクは取得しない。
+    """
+    if links is None:
+        links = [safe_get(row, IMAGE_LINK_KEYS) for row in records.to_dict("records")]
+    urls = [_embed_url(link) for link in links]
+    # 画像は先読みスレッドで取得し、埋め込み用ファイルにしておく
+    if work_dir is None:
+        return prefetch_images(urls, load=partial(load_embed, max_width=USABLE_WIDTH, max_height=PAGE_USABLE_H))
+    return prefetch_images(
+        urls,
+        prepare=partial(prepare_embed, work_dir=work_dir, max_width=USABLE_WIDTH, max_height=PAGE_USABLE_H),
+    )
+
+
+# ===== 1問分のレイアウト =====
+
+class Fragment(NamedTuple):
+    """描画位置まで決めた1問分の中身（ページに詰めて描くだけでよい形）。
+
+    各行は (x座標, フォント, 文字列) の並び。image は (ファイル, 表示幅, 表示高さ)。
+    height は改ページの判定に使う高さの見積り。
+    """
+    lines: tuple
+    image: tuple | None
+    image_lines: tuple
+    tail: tuple
+    height: float
+
+
+def question_fields(row) -> tuple:
+    """レイアウトに使う値（問題番号, 問題文, 選択肢1〜5, 正解, 分類, 画像リンク）"""
+    return (
+        safe_get(row, NUMBER_KEYS),
+        safe_get(row, QUESTION_KEYS),
+        *(safe_get(row, [f"選択肢{i}"]) for i in range(1, 6)),
+        safe_get(row, ANSWER_KEYS),
+        safe_get(row, CATEGORY_KEYS),
+        safe_get(row, IMAGE_LINK_KEYS),
+    )
+
+
+def _line_runs(line: str) -> tuple:
+    """1行をフォントごとの (x座標, フォント, 文字列) に分ける。"""
+    x = LEFT_MARGIN
+    runs = []
+    for font, chunk in _split_font_runs(line):
+        if not chunk:
+            continue
+        runs.append((x, font, chunk))
+        x += stringWidth(chunk, font, 12)
+    return tuple(runs)
+
+
+def _layout_lines(prefix: str, value: str) -> tuple:
+    return tuple(_line_runs(ln) for ln in wrapped_lines(prefix, value, USABLE_WIDTH, JAPANESE_FONT, 12))
+
+
+def layout_question(fields: tuple, img, error: BaseException | None = None) -> Fragment:
+    """question_fields の値と埋め込み用画像（無ければ None）から1問分を組む。
+
+    画像を取得できなかったときは error（取得時の例外）の短い理由を添える。
+    """
+    no, q, *choices, ans, cat, link = fields
+    # 問題番号の列がある DB（97_118DB など）だけ先頭に出す
+    lines = _layout_lines("問題番号: ", no) if no else ()
+    lines += _layout_lines("問題文: ", q)
+    for i, v in enumerate(choices, start=1):
+        if v:
+            lines += _layout_lines(f"選択肢{i}: ", v)
+    image, image_lines = None, ()
+    if img is not None:
+        nw, nh = display_size(img.width, img.height, USABLE_WIDTH, PAGE_USABLE_H)
+        image = (img.path, nw, nh)
+    elif link:
+        reason = f": {describe_fetch_error(error)}" if error is not None else ""
+        image_lines = _layout_lines("", f"[画像読み込み失敗{reason}]")
+    tail = _layout_lines("正解: ", ans) + _layout_lines("分類: ", cat)
+    height = (len(lines) + len(image_lines) + len(tail)) * LINE_H + 20
+    if image is not None:
+        height += image[2] + 20
+    return Fragment(lines, image, image_lines, tail, height)
+
+
+def layout_records(records, store=None, images=None, work_dir=None):
+    """records と同じ順に Fragment を返すジェネレータ。
+
+    store（pdf_fragments.FragmentStore など、get(fields) で断片を返すもの）にある問題はそれを使い、
+    無い問題だけ画像を取得してその場で組む。images は records と同じ順の (埋め込み用画像, 例外) の並び。
+    images を渡さないときの埋め込み用画像は work_dir に作る（prefetch_embed_images と同じ）。
+    """
+    fields = [question_fields(row) for row in records.to_dict("records")]
+    stored = [store.get(f) if store is not None else None for f in fields]
+    if images is None:
+        links = [f[-1] if frag is None else "" for f, frag in zip(fields, stored)]
+        images = prefetch_embed_images(records, work_dir=work_dir, links=links)
+    for f, frag, (img, error) in zip(fields, stored, images):
+        yield frag if frag is not None else layout_question(f, img, error)
+
+
+# ===== ページへの詰め込みと描画 =====
+class _NullText:
+    def setFont(self, *args, **kwargs):
+        pass
+
+    def setTextOrigin(self, *args, **kwargs):
+        pass
+
+    def textOut(self, *args, **kwargs):
+        pass
+
+
+class _NullCanvas:
+    """描画せずにページ送りだけを数えるための canvas の代役。"""
+    def showPage(self):
+        pass
+
+    def setFont(self, *args, **kwargs):
+        pass
+
+    def beginText(self, *args, **kwargs):
+        return _NullText()
+
+    def drawText(self, *args, **kwargs):
+        pass
+
+    def drawImage(self, *args, **kwargs):
+        pass
+
+
+def _render(c, fragments, total: int, progress=None):
+    """Fragment を順にページへ詰めて c に描画する。
+
+    各問題の描画直前のページ番号（0始まり）とページ先頭かどうかの並び、および総ページ数を返す。
+    """
+    top = PAGE_HEIGHT - TOP_MARGIN
+    y = top
+    page = 0
+    starts = []
+
+    def new_page():
+        nonlocal y, page
+        c.showPage()
+        c.setFont(JAPANESE_FONT, 12)
+        y = top
+        page += 1
+
+    def draw_lines(lines):
+        # 1問分の行は1つのテキストオブジェクトにまとめて書く
+        nonlocal y
+        if not lines:
+            return
+        t = c.beginText()
+        current = None
+        for runs in lines:
+            for x, font, chunk in runs:
+                if font != current:
+                    t.setFont(font, 12)
+                    current = font
+                t.setTextOrigin(x, y)
+                t.textOut(chunk)
+            y -= LINE_H
+        c.drawText(t)
+
+    for idx, frag in enumerate(fragments, start=1):
+        # ページ先頭を必ず問題文から
+        starts.append((page, y == top))
+        if y - frag.height < BOTTOM_MARGIN:
+            new_page()
+
+        draw_lines(frag.lines)
+        if frag.image is not None:
+            path, nw, nh = frag.image
+            try:
+                if y - nh < BOTTOM_MARGIN:
+                    new_page()
+                remaining = y - BOTTOM_MARGIN
+                if nh > remaining:
+                    adj = remaining / nh
+                    nw, nh = nw * adj, nh * adj
+                # JPEG は DCT のまま、同じ画像は1つの XObject を共有して埋め込まれる
+                c.drawImage(path, LEFT_MARGIN, y - nh, width=nw, height=nh, preserveAspectRatio=True, mask='auto')
+                y -= nh + 20
+            except Exception as e:
+                draw_lines(_layout_lines("", f"[画像読み込み失敗: {e}]"))
+        draw_lines(frag.image_lines)
+        draw_lines(frag.tail)
+
+        if y - 20 < BOTTOM_MARGIN:
+            new_page()
+        else:
+            y -= 20
+
+        if progress is not None:
+            progress(idx, total)
+
+    return starts, page + 1
+
+
+# ===== PDF 作成（ページ先頭は必ず問題文から／画像は必ず表示）=====
+def create_pdf(records, progress=None, out=None, images=None, store=None, fragments=None):
+    """records を1つの PDF にする。
+
+    progress(完了件数, 全件数) を渡すと1問ごとに呼ぶ。
+    out（書き込み用ファイル）を渡すとそこへ直接書き出し、メモリ上に PDF 全体のコピーを持たない。
+    images は records と同じ順の (埋め込み用画像, 例外) の並び。省略時はここで取得する。
+    store（事前に作った断片）にある問題はレイアウトし直さない。
+    fragments（組み済みの Fragment の並び）を渡すと records は件数にだけ使う。
+    """
+    pdf_buffer = out if out is not None else io.BytesIO()
+    c = canvas.Canvas(pdf_buffer, pagesize=A4)
+    c.setFont(JAPANESE_FONT, 12)
+
+    if fragments is None:
+        fragments = layout_records(records, store=store, images=images)
+    _render(c, fragments, len(records), progress)
+    c.save()
+    if out is not None:
+        out.flush()
+        return out
+    pdf_buffer.seek(0)
+    return pdf_buffer.getvalue()
+
+
+# ===== 複数プロセスでの並列作成 =====
+def _split_points(starts, parts: int) -> list[int]:
+    """ほぼ等分の位置に近い「ページ先頭から始まる問題」で区切る（先頭の0を含む）。"""
+    n = len(starts)
+    points = [0]
+    for k in range(1, parts):
+        target = max(points[-1] + 1, n * k // parts)
+        cut = next((i for i in range(target, n) if starts[i][1]), None)
+        if cut is None:
+            break
+        if cut > points[-1]:
+            points.append(cut)
+    return points
+
+
+def _render_part(fragments, path, queue, part_no):
+    """子プロセス側: 担当分の断片を1つの PDF に描画する。進捗は queue へ送る。"""
+    def report(done, total):
+        queue.put((part_no, done))
+
+    with open(path, "wb") as f:
+        create_pdf(fragments, progress=report, out=f, fragments=fragments)
+    return path
+
+
+def create_pdf_parallel(records, out, workers: int | None = None, progress=None, store=None):
+    """create_pdf と同じ PDF を複数プロセスで描画して作る。
+
+    1. 全問題を組み（store に無い問題は画像を取得し、埋め込み用画像を作業用ディレクトリに作って組む）、
+       描画なしでページに詰めて各問題の開始ページを求める
+    2. ページ先頭から始まる問題の位置で断片を区切り、塊ごとに子プロセスで描画する
+    3. 各塊の PDF から本来のページ数ぶんだけを取り出して順に結合する
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(records) < PARALLEL_MIN_RECORDS:
+        return create_pdf(records, progress=progress, out=out, store=store)
+
+    from pypdf import PdfReader, PdfWriter
+
+    total = len(records)
+    with tempfile.TemporaryDirectory(prefix="dental_db_parts_") as work_dir:
+        # 子プロセスが描くまでにキャッシュの掃除で派生画像が消えないよう、作業用ディレクトリに作る
+        fragments = list(layout_records(records, store=store, work_dir=work_dir))
+        starts, page_count = _render(_NullCanvas(), fragments, total)
+
+        # 塊を workers より多めに作り、描画の重い塊に引きずられにくくする
+        points = _split_points(starts, workers * 2)
+        bounds = list(zip(points, points[1:] + [total]))
+        page_ranges = [
+            (starts[a][0], starts[b][0] if b < total else page_count) for a, b in bounds
+        ]
+
+        ctx = get_context("spawn")
+        with ctx.Manager() as manager, ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+            queue = manager.Queue()
+            futures = [
+                pool.submit(
+                    _render_part,
+                    fragments[a:b],
+                    os.path.join(work_dir, f"part{k:04d}.pdf"),
+                    queue,
+                    k,
+                )
+                for k, (a, b) in enumerate(bounds)
+            ]
+            done_by_part = [0] * len(bounds)
+            pending = set(futures)
+            while pending:
+                finished, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    fut.result()  # 子プロセスの例外はここで表に出す
+                try:
+                    while True:
+                        part_no, done = queue.get_nowait()
+                        done_by_part[part_no] = max(done_by_part[part_no], done)
+                except Empty:
+                    pass
+                if progress is not None:
+                    progress(sum(done_by_part), total)
+            part_paths = [fut.result() for fut in futures]
+
+        writer = PdfWriter()
+        for path, (first, last) in zip(part_paths, page_ranges):
+            reader = PdfReader(path)
+            # 塊の末尾で改ページした場合の空ページは、次の塊の1ページ目と重なるので捨てる
+            for page in reader.pages[: last - first]:
+                writer.add_page(page)
+        writer.write(out)
+    if progress is not None:
+        progress(total, total)
+    if hasattr(out, "flush"):
+        out.flush()
+    return out
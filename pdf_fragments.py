@@ -0,0 +1,148 @@
+"""PDF 用の1問ごとのレイアウト断片を事前に作って保存する（Streamlit に依存しない）。
+
+問題の中身は変わらないので、折り返し・文字幅計算・フォント振り分け・画像の取得と縮小を
+DB の全問題について先に済ませておく。書き出し時は保存済みの断片（高さ計測済み）を
+ページに詰めて描くだけになる。断片の無い問題（作成時に画像を取得できなかったものなど）は
+従来どおりその場でレイアウトする。
+
+断片は CSV の隣の .fragments/ に、埋め込み用の画像は .fragments/images/ に置く。
+ファイル名に CSV の SHA-256 を含めるので、CSV を差し替えると使われなくなる。
+フォント・ページ設定が変わった場合も、保存時のレイアウト設定と一致しなければ使わない。
+
+    python pdf_fragments.py 97_119DB.csv
+"""
+import hashlib
+import pickle
+import sys
+from pathlib import Path
+
+from pdf_export import (
+    FALLBACK_FONT,
+    JAPANESE_FONT,
+    LINE_H,
+    PAGE_HEIGHT,
+    PAGE_USABLE_H,
+    PAGE_WIDTH,
+    SYMBOL_FONT,
+    USABLE_WIDTH,
+    Fragment,
+    layout_question,
+    prefetch_embed_images,
+    question_fields,
+)
+from pdf_images import TARGET_DPI
+from question_db import file_digest, load_questions
+
+# 保存内容（Fragment の形・レイアウトの手順）を変えたら上げる
+FRAGMENT_VERSION = 2
+FRAGMENT_DIR = ".fragments"
+
+
+def layout_fingerprint() -> str:
+    """断片の中身を左右するフォント・ページ設定"""
+    settings = (FRAGMENT_VERSION, JAPANESE_FONT, FALLBACK_FONT, SYMBOL_FONT,
+                PAGE_WIDTH, PAGE_HEIGHT, USABLE_WIDTH, PAGE_USABLE_H, LINE_H, TARGET_DPI)
+    return hashlib.sha256(repr(settings).encode("utf-8")).hexdigest()
+
+
+def fragment_key(fields: tuple) -> bytes:
+    return hashlib.blake2b("\x1f".join(fields).encode("utf-8"), digest_size=16).digest()
+
+
+def fragments_path(csv_path, digest: str) -> Path:
+    csv_path = Path(csv_path)
+    return csv_path.parent / FRAGMENT_DIR / f"{csv_path.stem}.v{FRAGMENT_VERSION}.{digest[:16]}.pkl"
+
+
+class FragmentStore:
+    """問題の中身（question_fields の値）から保存済みの Fragment を引く。"""
+
+    def __init__(self, fragments: dict, layout: str):
+        self.fragments = fragments
+        self.layout = layout
+
+    def __len__(self):
+        return len(self.fragments)
+
+    def get(self, fields: tuple) -> Fragment | None:
+        return self.fragments.get(fragment_key(fields))
+
+    @classmethod
+    def merge(cls, stores) -> "FragmentStore | None":
+        """複数の DB の断片を1つにする（None は飛ばす）。1つも無ければ None。"""
+        stores = [s for s in stores if s is not None]
+        if len(stores) <= 1:
+            return stores[0] if stores else None
+        fragments = {}
+        for store in stores:
+            fragments.update(store.fragments)
+        return cls(fragments, stores[0].layout)
+
+    @classmethod
+    def build(cls, csv_path, digest: str | None = None) -> tuple[Path, "FragmentStore"]:
+        """CSV の全問題を組んで保存する。古い版の保存ファイルは消す。"""
+        csv_path = Path(csv_path)
+        digest = digest or file_digest(csv_path)
+        path = fragments_path(csv_path, digest)
+        image_dir = path.parent / "images"
+        image_dir.mkdir(parents=True, exist_ok=True)
+
+        records = load_questions(csv_path)
+        fields = [question_fields(row) for row in records.to_dict("records")]
+        fragments = {}
+        images = prefetch_embed_images(records, image_dir, links=[f[-1] for f in fields])
+        for f, (img, _) in zip(fields, images):
+            # 画像を取得できなかった問題は保存せず、書き出し時に取得し直させる
+            if f[-1] and img is None:
+                continue
+            fragments[fragment_key(f)] = layout_question(f, img)
+
+        store = cls(fragments, layout_fingerprint())
+        store.save(path)
+        for old in path.parent.glob(f"{csv_path.stem}.v*.pkl"):
+            if old != path:
+                old.unlink(missing_ok=True)
+        return path, store
+
+    def save(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        with open(tmp, "wb") as f:
+            pickle.dump(
+                {"version": FRAGMENT_VERSION, "layout": self.layout,
+                 "fragments": {k: tuple(v) for k, v in self.fragments.items()}},
+                f,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, csv_path, digest: str | None = None) -> "FragmentStore | None":
+        """保存済みの断片を読む。無い・形式違い・レイアウト設定違い・破損なら None。"""
+        digest = digest or file_digest(csv_path)
+        try:
+            with open(fragments_path(csv_path, digest), "rb") as f:
+                data = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            return None
+        if not isinstance(data, dict) or data.get("version") != FRAGMENT_VERSION:
+            return None
+        if data.get("layout") != layout_fingerprint():
+            return None
+        fragments = {k: Fragment(*v) for k, v in data["fragments"].items()}
+        # 画像ファイルが消えている断片は使わない（その問題はその場でレイアウトし直す）
+        missing = {
+            frag.image[0] for frag in fragments.values()
+            if frag.image is not None and not Path(frag.image[0]).exists()
+        }
+        if missing:
+            fragments = {k: v for k, v in fragments.items() if v.image is None or v.image[0] not in missing}
+        return cls(fragments, data["layout"])
+
+
+if __name__ == "__main__":
+    targets = sys.argv[1:] or ["97_119DB.csv"]
+    for name in targets:
+        path, store = FragmentStore.build(name)
+        print(f"{name}: {len(store)}問 -> {path}")
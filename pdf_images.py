@@ -0,0 +1,83 @@
+"""PDF へ埋め込む画像の下ごしらえ。
+
+以前は画像を必ず RGB にデコードして PNG に再エンコードしてから ReportLab に渡していた。
+ここでは:
+- JPEG はバイト列をそのまま .jpg で置き、ReportLab に DCT ストリームとして素通しさせる
+- 表示サイズに対して解像度が高すぎる画像だけ、目標 DPI まで1回だけ縮小する
+- ファイル名を内容のハッシュにするので、同じ画像は PDF 内で1つの XObject を共有する
+  （canvas.drawImage はファイル名で XObject を使い回す）
+"""
+import hashlib
+import io
+import os
+import threading
+from pathlib import Path
+from typing import NamedTuple
+
+from PIL import Image
+
+# 縮小するときの目標解像度（印刷で粗さが目立たない程度）
+TARGET_DPI = 150
+JPEG_QUALITY = 85
+
+_PASS_THROUGH_MODES = ("RGB", "L", "CMYK")
+
+
+class EmbedImage(NamedTuple):
+    """drawImage に渡すファイルと、レイアウト計算用の元画像サイズ（px = pt として扱う）"""
+    path: str
+    width: int
+    height: int
+
+
+def display_size(iw: float, ih: float, max_width: float, max_height: float) -> tuple[float, float]:
+    """create_pdf と同じ規則（等倍以下・幅と高さに収める）での表示サイズ（pt）"""
+    scale = min(max_width / iw, max_height / ih, 1.0)
+    return iw * scale, ih * scale
+
+
+def prepare_embed(data: bytes, work_dir, max_width: float, max_height: float,
+                  dpi: int = TARGET_DPI) -> EmbedImage:
+    """画像バイト列を、そのまま drawImage に渡せるファイルにして返す。"""
+    im = Image.open(io.BytesIO(data))
+    iw, ih = im.size
+    dw, dh = display_size(iw, ih, max_width, max_height)
+    tw = max(1, round(dw * dpi / 72))
+    th = max(1, round(dh * dpi / 72))
+    oversized = iw > tw and ih > th
+    is_jpeg = im.format == "JPEG" and im.mode in _PASS_THROUGH_MODES
+
+    key = hashlib.sha256(data).hexdigest()
+    work_dir = Path(work_dir)
+    if not oversized:
+        # 縮小不要: JPEG は素通し、それ以外は元のバイト列を ReportLab に1回だけデコードさせる
+        # （拡張子が .jpg/.jpeg のときだけ ReportLab は DCT 素通しを試みる）
+        path = work_dir / f"{key}.{'jpg' if is_jpeg else 'img'}"
+        if not path.exists():
+            _write_atomic(path, data)
+        return EmbedImage(str(path), iw, ih)
+
+    path = work_dir / f"{key}.{tw}x{th}.{'jpg' if is_jpeg else 'png'}"
+    if not path.exists():
+        if is_jpeg:
+            # JPEG は DCT 段階で粗く縮小してからデコードできる
+            im.draft("RGB", (tw, th))
+            im = im.convert("RGB")
+        else:
+            has_alpha = im.mode in ("RGBA", "LA", "PA") or "transparency" in im.info
+            im = im.convert("RGBA" if has_alpha else "RGB")
+        im = im.resize((tw, th), Image.LANCZOS)
+        buf = io.BytesIO()
+        if is_jpeg:
+            im.save(buf, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+        else:
+            im.save(buf, format="PNG")
+        _write_atomic(path, buf.getvalue())
+    return EmbedImage(str(path), iw, ih)
+
+
+def _write_atomic(path: Path, data: bytes):
+    """先読みスレッド同士で同じファイルを書いても壊れないよう、一時名から置き換える。"""
+    tmp = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
@@ -0,0 +1,171 @@
+"""複数の問題DB（CSV）を1つにまとめたコーパス（Streamlit に依存しない）。
+
+DB ごとのスナップショットを指定の順につなぎ、各行に次の列を足す。
+- _source: 収録元の DB（CSV のファイル名から拡張子を除いたもの）
+- _id: 元になった DB の行の ID（「97_119DB:123」= その DB の 123 行目）。DB を足しても引いても変わらない。
+  埋めた行（下記）は元の行と同じ _id なので、コーパスの中で一意とは限らない
+- _sources: その問題が入っていた DB（「|」区切り）
+- _own: その DB の行そのもの（DB で絞ったときはこの行だけを出すので、その DB だけを検索したのと同じ結果になる）
+- _canonical: DB で絞らないときに出す行（DB をまたぐ重複を除いた一覧）
+DB をまたぐ重複は question_dedupe のクラスタの対応表で見つける。クラスタごとに先に指定した DB の行を残し、
+後の DB の行は一覧から外す（同じ DB の中の重複は、別の回に出た同じ問題なので残す）。
+残した行に無い値（画像のリンクなど）が外した行にあれば、それで埋めた行を元の行のすぐ後ろに足して一覧に出す
+（元の行は DB で絞ったときだけ出す）。埋めるのは出典（版は問わない）が同じか出典の無い行の値だけで、
+出典は問題文が同じ行からしか埋めない。
+"""
+import hashlib
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from exam_ids import BLOCK_COLUMN, EXAM_COLUMN, EXAM_ID_COLUMNS, NUMBER_COLUMN, format_exam_id
+from question_db import file_digest, load_questions
+from question_dedupe import THRESHOLD, ClusterMap, clusters_path, find_duplicates, normalize_stem, save_clusters
+
+SOURCE_COLUMN = "_source"
+ROW_ID_COLUMN = "_id"
+SOURCES_COLUMN = "_sources"
+OWN_COLUMN = "_own"
+CANONICAL_COLUMN = "_canonical"
+# 既定のコーパス（先の DB ほど重複の代表として残る）
+CORPUS_CSVS = ["97_119DB.csv", "97_118DB.csv", "image7559.csv"]
+
+
+def source_name(csv_path) -> str:
+    return Path(csv_path).stem
+
+
+def row_id(source: str, row: int) -> str:
+    return f"{source}:{row}"
+
+
+def corpus_version(csv_paths, digests=None, dedupe: bool = True) -> str:
+    """コーパスの版。DB が1つなら その CSV の SHA-256（単独の DB と同じ）、複数なら各 DB の版と重複除去の有無から作る"""
+    digests = digests or [file_digest(p) for p in csv_paths]
+    if len(digests) == 1:
+        return digests[0]
+    h = hashlib.sha256()
+    for path, digest in zip(csv_paths, digests):
+        h.update(f"{source_name(path)}={digest};".encode())
+    h.update(b"dedupe" if dedupe else b"all")
+    return h.hexdigest()
+
+
+def load_cluster_map(csv_paths, path=None) -> ClusterMap:
+    """csv_paths をすべて今の中身で含む保存済みの対応表。無ければ作り直して保存する。"""
+    path = Path(path or clusters_path())
+    cluster_map = ClusterMap.load(path)
+    if cluster_map is not None and all(cluster_map.covers(p) for p in csv_paths):
+        return cluster_map
+    clusters, stats = find_duplicates(csv_paths)
+    try:
+        save_clusters(path, csv_paths, clusters, stats, THRESHOLD)
+    except OSError:
+        pass  # 書き込めない環境でもメモリ上の対応表で動かす
+    return ClusterMap(clusters, {Path(p).name: file_digest(p) for p in csv_paths})
+
+
+def load_corpus(csv_paths, cluster_map: ClusterMap | None = None) -> pd.DataFrame:
+    """DB をつないだ DataFrame（index は 0 からの連番）。cluster_map があれば DB をまたぐ重複を一覧から外す。"""
+    names = [source_name(p) for p in csv_paths]
+    if len(set(names)) != len(names):
+        raise ValueError(f"同じ名前の DB が重複しています: {names}")
+    frames = []
+    for path, name in zip(csv_paths, names):
+        df = load_questions(path)
+        rows = np.arange(len(df))
+        frames.append(df.assign(**{
+            SOURCE_COLUMN: name,
+            ROW_ID_COLUMN: [row_id(name, r) for r in rows],
+            SOURCES_COLUMN: name,
+            OWN_COLUMN: True,
+            CANONICAL_COLUMN: True,
+        }))
+    corpus = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+    # DB によって無い列は空文字で埋める（出典の列は 0）
+    for c in corpus.columns:
+        if corpus[c].isna().any():
+            corpus[c] = corpus[c].fillna(0 if pd.api.types.is_numeric_dtype(corpus[c]) else "")
+    if cluster_map is None or len(frames) == 1:
+        return corpus
+
+    # (ファイル名, 行番号) → (DB の順番, コーパスの行番号)
+    offsets = np.cumsum([0] + [len(f) for f in frames])
+    position = {Path(p).name: (k, offsets[k]) for k, p in enumerate(csv_paths)}
+    # 埋める値: 内容の列は列ごと、出典は4列まとめて（出典の無い行だけ）
+    fill_columns = [c for c in corpus.columns if not c.startswith("_")]
+    values = {c: corpus[c].to_numpy(dtype=object) for c in fill_columns + EXAM_ID_COLUMNS}
+    canonical = corpus[CANONICAL_COLUMN].to_numpy().copy()
+    sources = corpus[SOURCES_COLUMN].to_numpy(dtype=object).copy()
+    merged = {}  # 元の行 → 埋めた値
+
+    def exam_id(r):
+        # 版（ori / ori2）は問わない
+        return format_exam_id(values[EXAM_COLUMN][r], values[BLOCK_COLUMN][r], values[NUMBER_COLUMN][r])
+
+    for cluster in cluster_map.clusters:
+        members = sorted(
+            (k, offset + m["row"]) for m in cluster if m["source"] in position
+            for k, offset in [position[m["source"]]]
+        )
+        order = sorted({k for k, _ in members})
+        if len(order) < 2:
+            continue
+        found = "|".join(names[k] for k in order)
+        others = [r for k, r in members if k != order[0]]
+        for k, r in members:
+            sources[r] = found
+            if k != order[0]:
+                canonical[r] = False
+                continue
+            # 出典のある行は、出典が同じか出典の無い行からだけ埋める
+            own_id = exam_id(r)
+            donors = [o for o in others if not own_id or exam_id(o) in ("", own_id)]
+            fills = {}
+            for c in fill_columns:
+                if not str(values[c][r]).strip():
+                    donor = next((values[c][o] for o in donors if str(values[c][o]).strip()), None)
+                    if donor is not None:
+                        fills[c] = donor
+            if not own_id:
+                # 出典は問題文が同じ行からだけもらう（似ているだけの別の問題の出典を付けない）
+                stem = normalize_stem(values["問題文"][r])
+                donor = next(
+                    (o for o in donors if values[EXAM_COLUMN][o] and normalize_stem(values["問題文"][o]) == stem),
+                    None,
+                )
+                if donor is not None:
+                    fills.update({c: values[c][donor] for c in EXAM_ID_COLUMNS})
+            if fills:
+                merged[r] = fills
+                canonical[r] = False
+    corpus[SOURCES_COLUMN] = pd.Series(sources, index=corpus.index, dtype=str)
+    corpus[CANONICAL_COLUMN] = canonical
+    if not merged:
+        return corpus
+
+    # 埋めた行は元の行のすぐ後ろに置く（収録順の一覧で元の行と同じ位置に出る）
+    originals = np.fromiter(merged, dtype=np.int64, count=len(merged))
+    copies = corpus.iloc[originals].copy()
+    for i, fills in enumerate(merged.values()):
+        for c, value in fills.items():
+            copies.iat[i, copies.columns.get_loc(c)] = value
+    copies[OWN_COLUMN] = False
+    copies[CANONICAL_COLUMN] = True
+    keys = np.concatenate([np.arange(len(corpus), dtype=np.float64), originals + 0.5])
+    combined = pd.concat([corpus, copies], ignore_index=True)
+    return combined.iloc[np.argsort(keys, kind="stable")].reset_index(drop=True)
+
+
+def source_rows(df: pd.DataFrame) -> dict[str, np.ndarray]:
+    """DB ごとの、その DB の行そのもの（_own）の行番号（昇順）"""
+    own = df[OWN_COLUMN].to_numpy(dtype=bool)
+    sources = df[SOURCE_COLUMN].to_numpy(dtype=object)
+    return {name: np.flatnonzero(own & (sources == name)) for name in pd.unique(sources[own])}
+
+
+def canonical_rows(df: pd.DataFrame) -> np.ndarray | None:
+    """DB で絞らないときに出す行の行番号（昇順）。全行なら None"""
+    canonical = df[CANONICAL_COLUMN].to_numpy(dtype=bool)
+    return None if canonical.all() else np.flatnonzero(canonical)
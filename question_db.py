@@ -0,0 +1,184 @@
+"""問題DB（CSV）の読み込みと、高速起動用の列指向スナップショット。
+
+CSV の読み込み → 欠損の空文字化 → 列名の正規化 → 既知の文字化け修復 → 出典（試験回・領域・問番号）の解析
+までを済ませた結果を
+Arrow IPC（Feather v2、非圧縮）で CSV の隣の .snapshots/ に保存する。
+ファイル名に CSV の SHA-256 を含めるので、CSV を差し替えると自動的に作り直される。
+非圧縮の Arrow はメモリマップで読めるため、起動時の解析がほぼ不要になる。
+
+事前に作っておく場合:
+    python question_db.py 97_119DB.csv 97_118DB.csv image7559.csv
+"""
+import hashlib
+import re
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from exam_ids import EXAM_ID_COLUMNS, exam_id_columns
+
+# 保存内容（正規化の手順）を変えたら上げる
+SNAPSHOT_VERSION = 3
+SNAPSHOT_DIR = ".snapshots"
+
+KNOWN_MOJIBAKE = {
+    "�｢": "Ⅳ",
+    "�｣": "Ⅵ",
+    "�･": "Ⅶ",
+    "�ｦ": "Ⅷ",
+    "�ｧ": "Ⅸ",
+    "�ｨ": "Ⅹ",
+    "�ｩ": "Ⅺ",
+}
+
+COLUMN_ALIASES = {
+    "問題番号": ["問題番号ID", "ID", "設問番号", "問題ID"],
+    "問題文": ["設問", "問題", "本文"],
+    "選択肢1": ["選択肢Ａ", "選択肢a", "A", "ａ"],
+    "選択肢2": ["選択肢Ｂ", "選択肢b", "B", "ｂ"],
+    "選択肢3": ["選択肢Ｃ", "選択肢c", "C", "ｃ"],
+    "選択肢4": ["選択肢Ｄ", "選択肢d", "D", "ｄ"],
+    "選択肢5": ["選択肢Ｅ", "選択肢e", "E", "ｅ"],
+    "正解": ["解答", "答え", "ans", "answer"],
+    "科目分類": ["分類", "科目", "カテゴリ", "カテゴリー"],
+    "リンクURL": ["画像URL", "画像リンク", "リンク", "画像Link"],
+}
+
+# 1問分の値を取り出すときの候補列（先頭が正式名。別名は normalize_columns 前の DataFrame 用）
+NUMBER_KEYS = ["問題番号","問題番号ID","ID","設問番号"]
+QUESTION_KEYS = ["問題文","設問","問題","本文"]
+ANSWER_KEYS = ["正解","解答","答え"]
+CATEGORY_KEYS = ["科目分類","分類","科目"]
+IMAGE_LINK_KEYS = ["リンクURL","画像URL","画像リンク","リンク","画像Link"]
+
+# 出力（CSV/TXT/PDF）で必ず持たせる列
+OUTPUT_COLUMNS = ["問題文","選択肢1","選択肢2","選択肢3","選択肢4","選択肢5","正解","科目分類","リンクURL"]
+
+
+def repair_known_mojibake(text: str) -> str:
+    """旧文字コード変換で壊れた、対応が確定しているローマ数字を戻す。"""
+    repaired = "" if text is None else str(text)
+    for broken, correct in KNOWN_MOJIBAKE.items():
+        repaired = repaired.replace(broken, correct)
+    return repaired
+
+
+def safe_get(row: pd.Series | dict, keys, default=""):
+    """Series/辞書から安全に値を取得（NaN, 空白, 別名を考慮）"""
+    if isinstance(row, pd.Series):
+        row = row.to_dict()
+    for k in keys:
+        if k in row:
+            v = row.get(k)
+            try:
+                if pd.isna(v):
+                    continue
+            except Exception:
+                pass
+            s = str(v).strip() if v is not None else ""
+            if s:
+                return repair_known_mojibake(s)
+    return default
+
+
+def normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """BOM/空白/改行を除去し、よくある別名を正式名へ寄せる"""
+    def _clean(s):
+        s = str(s).replace("\ufeff", "")
+        return re.sub(r"[\u3000 \t\r\n]+", "", s)
+
+    df = df.copy()
+    df.columns = [_clean(c) for c in df.columns]
+
+    colset = set(df.columns)
+    for canon, cands in COLUMN_ALIASES.items():
+        if canon in colset:
+            continue
+        for c in cands:
+            if c in colset:
+                df.rename(columns={c: canon}, inplace=True)
+                colset.add(canon)
+                break
+    return df
+
+
+def ensure_output_columns(df: pd.DataFrame) -> pd.DataFrame:
+    out = df.copy()
+    for c in OUTPUT_COLUMNS:
+        if c not in out.columns:
+            out[c] = ""
+    return out
+
+
+def read_question_csv(csv_path) -> pd.DataFrame:
+    """CSV を読み、正規化・文字化け修復・出典の解析まで済ませる（スナップショットの中身と同じ）"""
+    # BOM 対策のため utf-8-sig、文字列で統一して取り込み
+    df = pd.read_csv(csv_path, dtype=str, encoding="utf-8-sig")
+    df = df.fillna("")
+    df = normalize_columns(df)
+    for c in df.columns:
+        col = df[c].astype(str)
+        for broken, correct in KNOWN_MOJIBAKE.items():
+            col = col.str.replace(broken, correct, regex=False)
+        df[c] = col
+    # 問題文のタグ（[97A1-ori] など）を型付きの列へ（_exam / _block / _number / _variant）
+    # （書き出した CSV を読み直したときなど、同名の列があれば解析し直した値で置き換える）
+    return df.drop(columns=EXAM_ID_COLUMNS, errors="ignore").join(exam_id_columns(df))
+
+
+def file_digest(path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def snapshot_path(csv_path, digest: str) -> Path:
+    csv_path = Path(csv_path)
+    return csv_path.parent / SNAPSHOT_DIR / f"{csv_path.stem}.v{SNAPSHOT_VERSION}.{digest[:16]}.arrow"
+
+
+def build_snapshot(csv_path, digest: str | None = None) -> tuple[Path, pd.DataFrame]:
+    """CSV からスナップショットを作り直す。古い版のスナップショットは消す。"""
+    csv_path = Path(csv_path)
+    digest = digest or file_digest(csv_path)
+    df = read_question_csv(csv_path)
+    path = snapshot_path(csv_path, digest)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    table = pa.Table.from_pandas(df.reset_index(drop=True), preserve_index=False)
+    # メモリマップで読めるよう非圧縮で書く
+    feather.write_feather(table, tmp, compression="uncompressed")
+    tmp.replace(path)
+    for old in path.parent.glob(f"{csv_path.stem}.v*.arrow"):
+        if old != path:
+            old.unlink(missing_ok=True)
+    return path, df
+
+
+def load_questions(csv_path) -> pd.DataFrame:
+    """スナップショットがあればそれを、無ければ CSV から作って返す。"""
+    csv_path = Path(csv_path)
+    digest = file_digest(csv_path)
+    path = snapshot_path(csv_path, digest)
+    if path.exists():
+        try:
+            return feather.read_feather(path, memory_map=True)
+        except (OSError, pa.ArrowInvalid):
+            pass  # 壊れていれば作り直す
+    try:
+        return build_snapshot(csv_path, digest)[1]
+    except OSError:
+        # 書き込めない環境では CSV から読んだ結果をそのまま使う
+        return read_question_csv(csv_path)
+
+
+if __name__ == "__main__":
+    targets = sys.argv[1:] or ["97_119DB.csv", "97_118DB.csv", "image7559.csv"]
+    for name in targets:
+        path, df = build_snapshot(name)
+        print(f"{name}: {len(df)}行 -> {path}")
@@ -0,0 +1,300 @@
+"""問題DB をまたいだ重複・ほぼ重複の問題の検出（MinHash + LSH）。
+
+同じ問題が DB ごとにタグ（[97A2-ori] / [97A2]）や科目分類、「1つ選べ。」の有無だけ違って入っている。
+全組み合わせを比べる代わりに:
+1. 問題文（タグを除く）と選択肢（並びは問わない）を fold_text でそろえ、文字 3-gram の集合にする
+2. 集合ごとに NUM_PERM 個の MinHash の値（署名）を numpy でまとめて求める
+3. 署名を BANDS 個の帯に分け、ある帯が丸ごと一致する問題どうしだけを候補の組にする（LSH）
+4. 候補の組だけ 3-gram 集合の Jaccard 係数を実際に求め、しきい値以上を似ている順に同じクラスタにまとめる。
+   ただし出典（回・領域・問番号。版は問わない）の違う問題が同じクラスタに入る組はまとめない
+   （別の回の似た問題どうしや、それをつなぐ出典の無い問題を介して、別の問題がまとまらないように）
+件数にほぼ比例する時間で済み、結果（クラスタの対応表）を JSON に書き出す。
+統合したコーパスや書き出しは、この対応表を引くだけで重複を除ける。
+
+    python question_dedupe.py                             # 97_119DB / 97_118DB / image7559
+    python question_dedupe.py 97_119DB.csv image7559.csv --threshold 0.8 --out clusters.json
+"""
+import argparse
+import json
+import re
+import sys
+import time
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+from exam_ids import (
+    BLOCK_COLUMN,
+    EXAM_COLUMN,
+    NUMBER_COLUMN,
+    VARIANT_COLUMN,
+    format_exam_id,
+    strip_exam_tags,
+)
+from question_db import file_digest, load_questions
+from text_fold import fold_text
+
+# 保存形式・比較の手順を変えたら上げる
+DEDUPE_VERSION = 3
+DEDUPE_DIR = ".dedupe"
+CLUSTERS_NAME = "clusters.json"
+DEFAULT_CSVS = ["97_119DB.csv", "97_118DB.csv", "image7559.csv"]
+SHINGLE_SIZE = 3
+NUM_PERM = 128
+# 32帯 × 4行: Jaccard 0.7 の組はほぼ確実に（99.9%）候補になり、0.3 未満はあまり候補にならない
+BANDS = 32
+THRESHOLD = 0.7
+SEED = 1
+# (a * x + b) mod p の p（2^32 より大きい素数）。a, b, x は 2^32 未満なので uint64 で溢れない
+_PRIME = 4294967311
+# 署名をまとめて求めるときの 1 回あたりの 3-gram 数（メモリは この数 × NUM_PERM × 8 バイト）
+_CHUNK_SHINGLES = 1 << 15
+_SPACE_RE = re.compile(r"\s+")
+
+
+def clusters_path() -> Path:
+    return Path(__file__).parent / DEDUPE_DIR / CLUSTERS_NAME
+
+
+def normalize_stem(text: str) -> str:
+    """比較用の問題文（タグを除き、fold_text でそろえて空白を除いたもの）"""
+    return _SPACE_RE.sub("", fold_text(strip_exam_tags(str(text))))
+
+
+def question_shingles(row: dict) -> set[str]:
+    """タグを除いた問題文と選択肢（並べ替えて連結）の文字 3-gram。問題文も選択肢も無ければ空集合"""
+    choices = sorted(str(row.get(f"選択肢{i}", "")).strip() for i in range(1, 6))
+    choices = _SPACE_RE.sub("", fold_text("|".join(c for c in choices if c)))
+    text = (normalize_stem(row.get("問題文", "")) + "|" + choices).strip("|")
+    if not text:
+        return set()
+    if len(text) <= SHINGLE_SIZE:
+        return {text}
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def minhash_signatures(shingle_sets, num_perm: int = NUM_PERM, seed: int = SEED) -> np.ndarray:
+    """(件数, num_perm) の MinHash 署名。空の集合は使わないこと。"""
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 1 << 32, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, 1 << 32, size=num_perm, dtype=np.uint64)
+    sizes = np.fromiter(map(len, shingle_sets), dtype=np.int64, count=len(shingle_sets))
+    hashes = np.fromiter(
+        (zlib.crc32(s.encode("utf-8")) for shingles in shingle_sets for s in shingles),
+        dtype=np.uint64, count=int(sizes.sum()),
+    )
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    signatures = np.empty((len(shingle_sets), num_perm), dtype=np.uint64)
+    doc = 0
+    while doc < len(shingle_sets):
+        # 3-gram が _CHUNK_SHINGLES 個ほどになるまで問題をまとめ、各問題の区間ごとに最小値をとる
+        end = int(np.searchsorted(starts, starts[doc] + _CHUNK_SHINGLES, side="right"))
+        end = max(end, doc + 1)
+        lo, hi = starts[doc], starts[end - 1] + sizes[end - 1]
+        values = (hashes[lo:hi, None] * a + b) % _PRIME
+        signatures[doc:end] = np.minimum.reduceat(values, starts[doc:end] - lo, axis=0)
+        doc = end
+    return signatures
+
+
+def candidate_pairs(signatures: np.ndarray, bands: int = BANDS) -> set[tuple[int, int]]:
+    """ある帯の値が丸ごと一致する（同じバケットに入る）問題の組"""
+    rows = signatures.shape[1] // bands
+    pairs = set()
+    for band in range(bands):
+        keys = np.ascontiguousarray(signatures[:, band * rows:(band + 1) * rows])
+        keys = keys.view(np.dtype((np.void, keys.dtype.itemsize * rows))).ravel()
+        _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+        shared = np.flatnonzero(counts[inverse] > 1)
+        if not len(shared):
+            continue
+        # 同じバケットの問題を並べ、バケットごとに全組を作る（バケットは小さい）
+        shared = shared[np.argsort(inverse[shared], kind="stable")]
+        buckets = np.split(shared, np.flatnonzero(np.diff(inverse[shared])) + 1)
+        for bucket in buckets:
+            members = bucket.tolist()
+            for i, x in enumerate(members):
+                for y in members[i + 1:]:
+                    pairs.add((x, y))
+    return pairs
+
+
+def jaccard(x: set, y: set) -> float:
+    if not x and not y:
+        return 1.0
+    return len(x & y) / len(x | y)
+
+
+class _UnionFind:
+    """labels（出典。無ければ ""）の違う要素が同じ組に入らないようにまとめる"""
+
+    def __init__(self, labels):
+        self.parent = list(range(len(labels)))
+        self.labels = list(labels)  # 根ごとの、その組の出典
+
+    def find(self, x: int) -> int:
+        while self.parent[x] != x:
+            self.parent[x] = self.parent[self.parent[x]]
+            x = self.parent[x]
+        return x
+
+    def union(self, x: int, y: int) -> bool:
+        """まとめたら（すでに同じ組でも）True。出典の違う組どうしならまとめずに False"""
+        x, y = self.find(x), self.find(y)
+        if x == y:
+            return True
+        if self.labels[x] and self.labels[y] and self.labels[x] != self.labels[y]:
+            return False
+        # 小さい番号（先に指定した DB の先の行）を代表にする
+        root, child = min(x, y), max(x, y)
+        self.parent[child] = root
+        self.labels[root] = self.labels[root] or self.labels[child]
+        return True
+
+
+def find_duplicates(csv_paths, threshold: float = THRESHOLD, bands: int = BANDS,
+                    num_perm: int = NUM_PERM) -> tuple[list[list[dict]], dict]:
+    """(2件以上のクラスタの並び, 集計) を返す。クラスタの先頭が代表（先に指定した DB の先の行）。"""
+    timings = {}
+    started = time.perf_counter()
+    members, shingle_sets, exams = [], [], []
+    for path in csv_paths:
+        df = load_questions(path)
+        ids = zip(df[EXAM_COLUMN], df[BLOCK_COLUMN], df[NUMBER_COLUMN], df[VARIANT_COLUMN])
+        for row_no, (row, exam_id) in enumerate(zip(df.to_dict("records"), ids)):
+            shingles = question_shingles(row)
+            if not shingles:
+                continue
+            members.append({"source": Path(path).name, "row": row_no, "id": format_exam_id(*exam_id)})
+            shingle_sets.append(shingles)
+            # 版（ori / ori2）は問わずに比べる
+            exams.append(format_exam_id(*exam_id[:3]))
+    timings["shingles"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    signatures = minhash_signatures(shingle_sets, num_perm)
+    timings["signatures"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    pairs = candidate_pairs(signatures, bands)
+    timings["lsh"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    groups = _UnionFind(exams)
+    similar = []
+    for x, y in pairs:
+        score = jaccard(shingle_sets[x], shingle_sets[y])
+        if score >= threshold:
+            similar.append((-score, x, y))
+    # 似ている組から順にまとめる（出典の食い違いでまとめられないときに、より似ている方を優先する）
+    similar.sort()
+    matched = rejected = 0
+    for _, x, y in similar:
+        if groups.union(x, y):
+            matched += 1
+        else:
+            rejected += 1
+    clusters = {}
+    for i in range(len(members)):
+        clusters.setdefault(groups.find(i), []).append(members[i])
+    clusters = [c for _, c in sorted(clusters.items()) if len(c) > 1]
+    timings["verify"] = time.perf_counter() - started
+
+    stats = {
+        "questions": len(members),
+        "candidate_pairs": len(pairs),
+        "matched_pairs": matched,
+        "conflicting_pairs": rejected,
+        "clusters": len(clusters),
+        "duplicates": sum(len(c) - 1 for c in clusters),
+        "cross_source_clusters": sum(1 for c in clusters if len({m["source"] for m in c}) > 1),
+        "seconds": {k: round(v, 3) for k, v in timings.items()},
+    }
+    return clusters, stats
+
+
+def save_clusters(path, csv_paths, clusters, stats, threshold: float):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    data = {
+        "version": DEDUPE_VERSION,
+        "threshold": threshold,
+        "sources": {Path(p).name: file_digest(p) for p in csv_paths},
+        "stats": stats,
+        "clusters": clusters,
+    }
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False, indent=1), encoding="utf-8")
+    tmp.replace(path)
+
+
+class ClusterMap:
+    """保存したクラスタの対応表。(DB のファイル名, 行番号) からクラスタと代表を引く。"""
+
+    def __init__(self, clusters, sources: dict):
+        self.clusters = clusters
+        self.sources = sources
+        self._by_row = {}
+        for k, cluster in enumerate(clusters):
+            for m in cluster:
+                self._by_row[(m["source"], m["row"])] = k
+
+    def __len__(self):
+        return len(self.clusters)
+
+    @classmethod
+    def load(cls, path=None) -> "ClusterMap | None":
+        """保存した対応表を読む。無い・形式違い・破損なら None。"""
+        try:
+            data = json.loads(Path(path or clusters_path()).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if not isinstance(data, dict) or data.get("version") != DEDUPE_VERSION:
+            return None
+        return cls(data["clusters"], data["sources"])
+
+    def covers(self, csv_path) -> bool:
+        """csv_path（の今の中身）がこの対応表を作ったときと同じか"""
+        return self.sources.get(Path(csv_path).name) == file_digest(csv_path)
+
+    def cluster(self, source: str, row: int) -> int | None:
+        return self._by_row.get((source, row))
+
+    def representative(self, source: str, row: int) -> tuple[str, int]:
+        """その問題のクラスタの代表（重複が無ければ自分自身）"""
+        k = self._by_row.get((source, row))
+        if k is None:
+            return source, row
+        first = self.clusters[k][0]
+        return first["source"], first["row"]
+
+    def is_duplicate(self, source: str, row: int) -> bool:
+        """代表ではないクラスタの一員（統合・書き出しで除いてよい問題）か"""
+        return self.representative(source, row) != (source, row)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("csv", nargs="*", default=DEFAULT_CSVS, help="比べる問題DB の CSV（先のものほど代表になる）")
+    parser.add_argument("--out", help=f"クラスタの対応表（既定: {DEDUPE_DIR}/{CLUSTERS_NAME}）")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="同じ問題とみなす 3-gram の Jaccard 係数")
+    parser.add_argument("--bands", type=int, default=BANDS, help=f"LSH の帯の数（{NUM_PERM} の約数）")
+    args = parser.parse_args(argv)
+
+    clusters, stats = find_duplicates(args.csv, threshold=args.threshold, bands=args.bands)
+    out = Path(args.out) if args.out else clusters_path()
+    save_clusters(out, args.csv, clusters, stats, args.threshold)
+    print(
+        f"{stats['questions']}問 / 候補 {stats['candidate_pairs']}組 → 一致 {stats['matched_pairs']}組"
+        f"（出典が違うので除外 {stats['conflicting_pairs']}組） / "
+        f"クラスタ {stats['clusters']}（DB をまたぐもの {stats['cross_source_clusters']}）・"
+        f"除ける重複 {stats['duplicates']}問 {stats['seconds']}",
+        file=sys.stderr,
+    )
+    print(f"-> {out}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
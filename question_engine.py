@@ -0,0 +1,200 @@
+"""問題DB（1つ、または複数をまとめたコーパス）の検索・書き出し（Streamlit に依存しない）。
+
+読み込み（スナップショット）・検索用テキストと n-gram インデックス・出典（試験回）のインデックス・
+関連度（BM25）の点数付け・検索結果のキャッシュ・事前に作った PDF 用の断片をまとめて持ち、検索と CSV / TXT / GoodNotes / PDF の書き出しを行う。
+複数の DB を渡すと question_corpus で1つにつなぎ、インデックスも1つにして全 DB をまとめて検索する
+（DB をまたぐ重複は除いて出す。収録元の DB で絞ると、その DB の行をそのまま出す）。
+両アプリ（db7559__12_pdf.py / rikougakkai.py）はこの上に画面を載せるだけなので、
+高速化はどちらのアプリにも効き、バッチ処理やベンチマークからも同じ処理を呼べる。
+
+    python question_engine.py 97_119DB.csv "レジン & 硬さ" --pdf out.pdf --txt out.txt
+    python question_engine.py 97_119DB.csv "レジン" --merge image7559.csv --source image7559 --txt out.txt
+    python question_engine.py all "110-119c" --csv out.csv                   # 3つの DB をまとめて
+    python question_engine.py 97_118DB.csv "118" --category 理工 --csv out.csv
+    python question_engine.py 97_119DB.csv "110-119c & レジン" --order exam_desc --txt out.txt
+    python question_engine.py 97_119DB.csv "歯周" --order relevance --limit 50 --pdf top50.pdf
+"""
+import argparse
+import io
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from exam_ids import ExamIndex
+from ngram_index import NgramIndex
+from pdf_export import create_pdf_parallel
+from pdf_fragments import FragmentStore
+from question_corpus import (
+    CORPUS_CSVS,
+    canonical_rows,
+    corpus_version,
+    load_cluster_map,
+    load_corpus,
+    source_name,
+    source_rows,
+)
+from question_db import ensure_output_columns, file_digest
+from question_search import (
+    ORDER_EXAM,
+    ORDER_EXAM_DESC,
+    ORDER_RELEVANCE,
+    SEARCH_TEXT_COLUMN,
+    ResultCache,
+    build_search_text,
+    parse_keywords,
+    search_rows,
+)
+from ranking import BM25Ranker
+from text_export import dataframe_to_goodnotes_bytes, records_to_text
+
+INDEX_DIR = ".index_cache"
+
+
+class QuestionEngine:
+    """問題DB（CSV）1つ、または複数の DB のコーパス。作るのは重いので、アプリではプロセスで1つだけ持つ。"""
+
+    def __init__(self, csv_paths, index_dir=None, dedupe: bool = True):
+        if isinstance(csv_paths, (str, Path)):
+            csv_paths = [csv_paths]
+        self.csv_paths = [Path(p) for p in csv_paths]
+        self.sources = [source_name(p) for p in self.csv_paths]
+        # 読み込んだ DB の版（DB が1つなら CSV の SHA-256）。書き出しのメモ化や検索結果のキャッシュのキーに使う
+        digests = [file_digest(p) for p in self.csv_paths]
+        self.version = corpus_version(self.csv_paths, digests, dedupe)
+        # 正規化・文字化け修復済みのスナップショットをつなぐ。DB をまたぐ重複は除く
+        cluster_map = load_cluster_map(self.csv_paths) if dedupe and len(self.csv_paths) > 1 else None
+        df = load_corpus(self.csv_paths, cluster_map)
+        df[SEARCH_TEXT_COLUMN] = build_search_text(df)
+        self.df = df
+        # 収録元の DB ごとのその DB の行と、DB で絞らないときの重複を除いた行（全行なら None）
+        self.source_rows = source_rows(df)
+        self.canonical_rows = canonical_rows(df)
+        # 検索用テキストの n-gram インデックス（全 DB で1つ。保存済みがあれば再構築しない）
+        index_dir = Path(index_dir) if index_dir is not None else Path(__file__).parent / INDEX_DIR
+        self.index = NgramIndex.load_or_build(
+            df[SEARCH_TEXT_COLUMN].tolist(), index_dir / f"{'+'.join(self.sources)}.ngram.pkl"
+        )
+        # 出典（試験回・領域・問番号）の並び。範囲の指定と試験回順の並べ替えに使う
+        self.exams = ExamIndex.from_frame(df)
+        # 関連度順で並べるときの点数付け（列ごとの重み付きの BM25）
+        self.ranker = BM25Ranker(df, self.index)
+        # 検索結果の行番号を全セッションで共有する LRU キャッシュ
+        self.results = ResultCache()
+        # 事前に作った PDF 用の断片（python pdf_fragments.py <CSV>）。どの DB にも無ければ None
+        self.fragments = FragmentStore.merge(
+            FragmentStore.load(p, digest) for p, digest in zip(self.csv_paths, digests)
+        )
+        self.categories = sorted(
+            value for value in df["科目分類"].unique().tolist() if str(value).strip()
+        ) if "科目分類" in df.columns else []
+
+    def __len__(self):
+        """重複を除いた問題の数"""
+        return len(self.df) if self.canonical_rows is None else len(self.canonical_rows)
+
+    # ---- 検索 ----
+    def search_rows(self, query: str, category: str | None = None,
+                    session_cache: ResultCache | None = None, order: str | None = None,
+                    limit: int | None = None, source: str | None = None) -> tuple[np.ndarray, int]:
+        """(並べた行番号, ヒットの総数)。
+
+        order は None（収録順）・ORDER_EXAM（試験回の古い順）・ORDER_EXAM_DESC（新しい順）・
+        ORDER_RELEVANCE（関連度順）。limit があれば先頭（関連度順なら上位）limit 件だけ返す。
+        source（収録元の DB 名）があれば、その DB の行だけにする（その DB だけを検索したのと同じ）。
+        None なら DB をまたぐ重複を除いた行から探す。
+        """
+        return search_rows(
+            self.df,
+            self.index,
+            parse_keywords(query),
+            category=category,
+            cache=self.results,
+            db_version=self.version,
+            session_cache=session_cache,
+            exam_index=self.exams,
+            order=order,
+            ranker=self.ranker,
+            limit=limit,
+            within=self._rows_of(source),
+        )
+
+    def _rows_of(self, source: str | None) -> np.ndarray | None:
+        if source is None:
+            return self.canonical_rows
+        return self.source_rows.get(source, np.empty(0, dtype=np.int64))
+
+    def take(self, rows) -> pd.DataFrame:
+        """行番号の行だけを、その順で DataFrame にする"""
+        return self.df.iloc[rows].reset_index(drop=True)
+
+    def search(self, query: str, category: str | None = None,
+               session_cache: ResultCache | None = None, order: str | None = None,
+               limit: int | None = None, source: str | None = None) -> pd.DataFrame:
+        """検索語（& 区切り）と科目分類（None なら絞らない）で問題を絞り込む（引数は search_rows と同じ）"""
+        rows, _ = self.search_rows(query, category, session_cache, order, limit, source)
+        return self.take(rows)
+
+    # ---- 書き出し ----
+    def to_csv(self, hits: pd.DataFrame) -> str:
+        buf = io.StringIO()
+        # 先頭が _ の列（検索用の内部列）は出力しない
+        ensure_output_columns(hits.loc[:, ~hits.columns.str.startswith("_")]).to_csv(buf, index=False)
+        return buf.getvalue()
+
+    def to_text(self, hits: pd.DataFrame) -> str:
+        return records_to_text(hits)
+
+    def to_goodnotes(self, hits: pd.DataFrame, **options) -> bytes:
+        """GoodNotes 用 CSV（Front/Back）。options は dataframe_to_goodnotes_bytes の引数"""
+        return dataframe_to_goodnotes_bytes(hits, **options)
+
+    def to_pdf(self, hits: pd.DataFrame, out, progress=None, workers: int | None = None):
+        """画像付き PDF を out（書き込み用ファイル）へ書き出す。
+
+        件数が多いときは複数プロセスで分担して描画し、事前に作った断片がある問題は
+        レイアウトし直さずページに詰めて描くだけにする。
+        """
+        return create_pdf_parallel(hits, out=out, workers=workers, progress=progress, store=self.fragments)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("csv", help="問題DB の CSV（「all」なら既定のコーパスの全 DB）")
+    parser.add_argument("query", nargs="?", default="", help="検索語（& 区切りで AND 検索）")
+    parser.add_argument("--merge", action="append", default=[],
+                        help="一緒に検索する DB の CSV（複数指定可。重複は先の DB の問題を残す）")
+    parser.add_argument("--source", help="収録元の DB（CSV のファイル名から拡張子を除いたもの）で絞る")
+    parser.add_argument("--keep-duplicates", action="store_true", help="DB をまたぐ重複を除かない")
+    parser.add_argument("--category", help="科目分類で絞る")
+    parser.add_argument("--order", choices=[ORDER_RELEVANCE, ORDER_EXAM, ORDER_EXAM_DESC],
+                        help="関連度順・試験回順に並べる（既定: 収録順）")
+    parser.add_argument("--limit", type=int, help="先頭（関連度順なら上位）の件数だけ書き出す")
+    parser.add_argument("--csv", dest="csv_out", help="ヒット結果の CSV")
+    parser.add_argument("--txt", help="ヒット結果の TEXT")
+    parser.add_argument("--goodnotes", help="GoodNotes 用 CSV（Front/Back）")
+    parser.add_argument("--pdf", help="画像付き PDF")
+    parser.add_argument("--workers", type=int, help="PDF を描画するプロセス数（既定: CPU 数）")
+    args = parser.parse_args(argv)
+
+    csv_paths = CORPUS_CSVS if args.csv == "all" else [args.csv] + args.merge
+    engine = QuestionEngine(csv_paths, dedupe=not args.keep_duplicates)
+    rows, total = engine.search_rows(args.query, args.category, order=args.order, limit=args.limit,
+                                     source=args.source)
+    hits = engine.take(rows)
+    print(f"{total}件ヒット（書き出し {len(hits)}件） / {len(engine)}件", file=sys.stderr)
+    if args.csv_out:
+        Path(args.csv_out).write_text(engine.to_csv(hits), encoding="utf-8")
+    if args.txt:
+        Path(args.txt).write_text(engine.to_text(hits), encoding="utf-8")
+    if args.goodnotes:
+        Path(args.goodnotes).write_bytes(engine.to_goodnotes(hits))
+    if args.pdf:
+        with open(args.pdf, "wb") as f:
+            engine.to_pdf(hits, f, workers=args.workers)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,209 @@
+"""キーワード検索（Streamlit に依存しない）。
+
+検索用テキスト列の作成と、n-gram インデックスを使った AND 検索・分類での絞り込み。
+出典の指定（「110-119c」「118a」など）の語は、部分一致ではなく出典のインデックスで引く。
+関連度順（ranking.BM25Ranker）では、ヒットのうち上位の件数だけを選んで DataFrame にする。
+検索結果（行番号の配列）はプロセス共通の LRU キャッシュに置き、
+同じ検索や、語を足しただけの検索（「レジン & 硬さ」→「レジン & 硬さ & 118」）では使い回す。
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from exam_ids import ExamIndex, parse_exam_query
+from ngram_index import NgramIndex
+from ranking import BM25Ranker
+from text_fold import fold_text
+from question_db import ensure_output_columns, repair_known_mojibake
+
+# 検索対象の列（リンク系カラムも含める。問題番号は列がある DB だけ）
+SEARCH_COLUMNS = ["問題番号","問題文","選択肢1","選択肢2","選択肢3","選択肢4","選択肢5","正解","科目分類","リンクURL"]
+SEARCH_TEXT_COLUMN = "_search_text"
+RESULT_CACHE_ENTRIES = 256
+# セッションごとに覚えておく直近の検索結果の数（入力途中の検索語を含む）
+SESSION_CACHE_ENTRIES = 16
+# 結果の並び順（None は収録順）
+ORDER_EXAM = "exam"            # 試験回の古い順
+ORDER_EXAM_DESC = "exam_desc"  # 試験回の新しい順
+ORDER_RELEVANCE = "relevance"  # 関連度（BM25）の高い順
+
+
+def build_search_text(df: pd.DataFrame) -> pd.Series:
+    """空でない検索対象列を空白でつなぎ、文字化け修復・表記ゆれの吸収（fold_text）をした検索用テキストを作る"""
+    base = ensure_output_columns(df)
+    columns = [base[c].astype(str).str.strip() for c in SEARCH_COLUMNS if c in base.columns]
+    texts = [
+        fold_text(repair_known_mojibake(" ".join(p for p in parts if p)))
+        for parts in zip(*columns)
+    ]
+    return pd.Series(texts, index=df.index, dtype=str)
+
+
+def parse_keywords(query: str) -> list[str]:
+    """「&」（全角の「＆」も可）区切りの検索語を、検索用テキストと同じ変換（fold_text）をしたキーワードの並びにする"""
+    return [kw.strip() for kw in fold_text(query or "").split("&") if kw.strip()]
+
+
+def normalize_keywords(keywords) -> frozenset[str]:
+    """語順・重複と、他の語に含まれている語（「レジン」と「レジン床」の「レジン」）を除いた集合"""
+    kws = {kw for kw in keywords if kw}
+    return frozenset(kw for kw in kws if not any(kw != other and kw in other for other in kws))
+
+
+def find_rows(search_index: NgramIndex, keywords, category: str | None, categories,
+              within=None) -> np.ndarray:
+    """全キーワードを含み、（指定があれば）分類が一致する行番号を昇順で返す。
+
+    within（昇順の行番号）を渡すと、その中だけを確かめる。
+    """
+    keywords = sorted(keywords)
+    if within is None:
+        # n-gram インデックスで候補行を絞り、候補だけ部分一致を確かめる
+        rows = np.asarray(search_index.search(keywords), dtype=np.int64)
+    else:
+        rows = np.asarray(search_index.refine(np.asarray(within).tolist(), keywords), dtype=np.int64)
+    if category is not None:
+        rows = rows[categories[rows] == category]
+    return rows
+
+
+class ResultCache:
+    """検索結果（行番号の配列）のプロセス共通 LRU キャッシュ。
+
+    キーは（正規化した検索語の集合, 分類, DB の版）。
+    完全一致が無くても、今回の結果を必ず含む結果（語が今回の語の一部で、分類が同じか絞っていない）が
+    あれば、その中から確かめるだけで済ませる。
+    """
+
+    def __init__(self, max_entries: int = RESULT_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.refined = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _lookup(self, keywords: frozenset, category, db_version):
+        """(行番号, その結果の検索語, 完全一致か) を返す。使える結果が無ければ (None, None, False)。"""
+        with self._lock:
+            key = (keywords, category, db_version)
+            rows = self._entries.get(key)
+            if rows is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return rows, keywords, True
+            best_key, best = None, None
+            for (kws, cat, version), cached in self._entries.items():
+                if version != db_version or (cat is not None and cat != category):
+                    continue
+                # キャッシュ側の語がすべて今回のどれかの語に含まれていれば、今回の結果はその部分集合
+                if not all(any(k in kw for kw in keywords) for k in kws):
+                    continue
+                if best is None or len(cached) < len(best):
+                    best_key, best = (kws, cat, version), cached
+            if best_key is None:
+                self.misses += 1
+                return None, None, False
+            self._entries.move_to_end(best_key)
+            self.refined += 1
+            return best, best_key[0], False
+
+    def _store(self, keywords: frozenset, category, db_version, rows: np.ndarray):
+        with self._lock:
+            self._entries[(keywords, category, db_version)] = rows
+            self._entries.move_to_end((keywords, category, db_version))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def search(self, search_index: NgramIndex, keywords, category: str | None, categories,
+               db_version: str, parent: "ResultCache | None" = None) -> np.ndarray:
+        """キャッシュを使って検索する。
+
+        parent（全セッション共通のキャッシュ）を渡すと、こちら（セッションごとの直近の結果）に
+        無いときはそちらも探し、計算した結果は両方に置く。
+        """
+        keywords = normalize_keywords(keywords)
+        rows, cached_keywords, exact = self._lookup(keywords, category, db_version)
+        if exact:
+            return rows
+        if parent is not None:
+            p_rows, p_keywords, p_exact = parent._lookup(keywords, category, db_version)
+            if p_exact:
+                self._store(keywords, category, db_version, p_rows)
+                return p_rows
+            # より小さい方の上位集合から絞る
+            if p_rows is not None and (rows is None or len(p_rows) < len(rows)):
+                rows, cached_keywords = p_rows, p_keywords
+        # 計算はロックの外で行う（同時に来た別の検索を待たせない）
+        if rows is None:
+            rows = find_rows(search_index, keywords, category, categories)
+        else:
+            # キャッシュ側のどれかの語に含まれる語は確かめ済みなので、残りの語だけ確かめる
+            extra = [kw for kw in keywords if not any(kw in k for k in cached_keywords)]
+            rows = find_rows(search_index, extra, category, categories, within=rows)
+        rows.flags.writeable = False  # セッション間で共有するので書き換えさせない
+        self._store(keywords, category, db_version, rows)
+        if parent is not None:
+            parent._store(keywords, category, db_version, rows)
+        return rows
+
+
+def search_rows(df: pd.DataFrame, search_index: NgramIndex, keywords,
+                category: str | None = None, cache: ResultCache | None = None,
+                db_version: str = "", session_cache: ResultCache | None = None,
+                exam_index: ExamIndex | None = None, order: str | None = None,
+                ranker: BM25Ranker | None = None, limit: int | None = None,
+                within: np.ndarray | None = None) -> tuple[np.ndarray, int]:
+    """(並べた行番号, ヒットの総数) を返す。limit があれば行番号は先頭（関連度順なら上位）limit 件だけ。
+
+    session_cache（そのセッションの直近の結果）を渡すと、語を足したときは前回のヒットだけを絞り、
+    語を消したときは前に出した結果をそのまま使う。
+    exam_index を渡すと、出典の指定の語はそのインデックスで引き、order（ORDER_EXAM など）で並べ替えられる。
+    ORDER_RELEVANCE には ranker が要る。
+    within（昇順の行番号。収録元の DB で絞るときなど）を渡すと、ヒットをその行に限る。
+    キャッシュには within で絞る前の結果を置くので、絞り方を変えても使い回せる。
+    """
+    categories = df["科目分類"].to_numpy(dtype=object)
+    exam_queries = []
+    if exam_index is not None:
+        text_keywords = []
+        for kw in keywords:
+            query = parse_exam_query(kw)
+            if query is None:
+                text_keywords.append(kw)
+            else:
+                exam_queries.append(query)
+        keywords = text_keywords
+    if exam_queries and not keywords:
+        # 出典だけの指定なら、全行を作らずに出典のインデックスから始める
+        rows = exam_index.select(exam_queries.pop(0))
+        if category is not None:
+            rows = rows[categories[rows] == category]
+    elif session_cache is not None:
+        rows = session_cache.search(search_index, keywords, category, categories, db_version, parent=cache)
+    elif cache is not None:
+        rows = cache.search(search_index, keywords, category, categories, db_version)
+    else:
+        rows = find_rows(search_index, normalize_keywords(keywords), category, categories)
+    for query in exam_queries:
+        rows = np.intersect1d(rows, exam_index.select(query), assume_unique=True)
+    if within is not None:
+        rows = np.intersect1d(rows, within, assume_unique=True)
+    total = len(rows)
+    if order == ORDER_RELEVANCE and ranker is not None:
+        # 点数を付けるのはヒットした行だけ。上位 limit 件はヒープで選ぶ
+        return ranker.top(rows, keywords, limit), total
+    if order in (ORDER_EXAM, ORDER_EXAM_DESC) and exam_index is not None:
+        rows = exam_index.sort(rows, descending=order == ORDER_EXAM_DESC)
+    return rows[:limit], total
+
+
+def filter_questions(df: pd.DataFrame, search_index: NgramIndex, keywords, **options) -> pd.DataFrame:
+    """search_rows の行を DataFrame にして返す（options は search_rows と同じ）"""
+    rows, _ = search_rows(df, search_index, keywords, **options)
+    return df.iloc[rows].reset_index(drop=True)
@@ -0,0 +1,90 @@
+"""検索結果の関連度順の並べ替え（文字 n-gram の BM25F）。
+
+検索語を n-gram に分け（NgramIndex と同じ 2-gram / 3-gram。1文字の語はその文字）、
+列ごとの出現回数に重み（問題文 > 選択肢・正解・分類 > 画像リンク）と列の長さの補正を掛けて合計し、
+BM25 の飽和（k1）と IDF で点数にする。
+点数を付けるのは AND 検索で残った行だけで、上位 k 件は部分選択（np.partition）で選んで
+その k 件だけを並べ替え、呼び出し側もその k 行だけを DataFrame にする。
+"""
+import math
+
+import numpy as np
+import pandas as pd
+
+from ngram_index import NgramIndex
+from question_db import repair_known_mojibake
+from text_fold import fold_text
+
+K1 = 1.2
+B = 0.75
+# (重み, 列)。同じ重みの列はつないで1つの欄として長さを補正する
+FIELD_WEIGHTS = [
+    (3.0, ["問題文"]),
+    (1.0, ["選択肢1","選択肢2","選択肢3","選択肢4","選択肢5","正解"]),
+    (1.0, ["科目分類"]),
+    (0.3, ["リンクURL"]),
+]
+
+
+class BM25Ranker:
+    """行番号（DataFrame の位置）に関連度の点数を付ける。"""
+
+    def __init__(self, df: pd.DataFrame, search_index: NgramIndex, k1: float = K1, b: float = B,
+                 field_weights=FIELD_WEIGHTS):
+        self.search_index = search_index
+        self.k1 = k1
+        self.n_docs = len(df)
+        self._doc_freq: dict[str, int] = {}
+        # 欄ごとの（検索用テキストと同じ変換をしたテキスト, 重み / 長さの補正）
+        self.fields = []
+        for weight, columns in field_weights:
+            columns = [c for c in columns if c in df.columns]
+            if not columns:
+                continue
+            parts = [df[c].astype(str).str.strip() for c in columns]
+            texts = [fold_text(repair_known_mojibake(" ".join(p for p in row if p))) for row in zip(*parts)]
+            lengths = np.fromiter(map(len, texts), dtype=np.float64, count=len(texts))
+            average = lengths.mean() if len(lengths) and lengths.mean() else 1.0
+            self.fields.append((texts, weight / (1 - b + b * lengths / average)))
+
+    def terms(self, keywords) -> list[tuple[str, float]]:
+        """検索語の n-gram と、その IDF"""
+        terms = {}
+        for kw in keywords:
+            for term in self.search_index.keyword_grams(kw) or {kw}:
+                if term in terms:
+                    continue
+                df = self._doc_freq.get(term)
+                if df is None:
+                    df = self._doc_freq[term] = self.search_index.document_frequency(term)
+                terms[term] = math.log(1 + (self.n_docs - df + 0.5) / (df + 0.5))
+        return sorted(terms.items())
+
+    def score(self, rows, keywords) -> np.ndarray:
+        """rows と同じ順の点数"""
+        rows = np.asarray(rows, dtype=np.int64)
+        scores = np.zeros(len(rows))
+        if not len(rows):
+            return scores
+        for term, idf in self.terms(keywords):
+            tf = np.zeros(len(rows))
+            for texts, norm in self.fields:
+                counts = np.fromiter((texts[i].count(term) for i in rows), dtype=np.float64, count=len(rows))
+                tf += counts * norm[rows]
+            scores += idf * tf * (self.k1 + 1) / (self.k1 + tf)
+        return scores
+
+    def top(self, rows, keywords, k: int | None = None) -> np.ndarray:
+        """点数の高い順の行番号（k があれば上位 k 件だけ）。同点は rows の中の順。"""
+        rows = np.asarray(rows, dtype=np.int64)
+        scores = self.score(rows, keywords)
+        if k is None or k >= len(rows):
+            return rows[np.argsort(-scores, kind="stable")]
+        if k <= 0:
+            return rows[:0]
+        # k 番目の点数を境に、それより高い行と、同点の行を先頭から足りない分だけ取る
+        threshold = np.partition(scores, len(rows) - k)[len(rows) - k]
+        above = np.flatnonzero(scores > threshold)
+        tied = np.flatnonzero(scores == threshold)[: k - len(above)]
+        best = np.concatenate([above, tied])
+        return rows[best[np.argsort(-scores[best], kind="stable")]]
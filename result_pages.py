@@ -0,0 +1,145 @@
+"""検索結果一覧とそのページ分け（両アプリ共通の Streamlit 部品）。
+
+一覧は1ページ分だけを切り出して描画し、各問題の中身は展開されたときだけ作る。
+再実行のたびにブラウザへ送るウィジェット数が、ヒット件数ではなくページの大きさで決まる。
+作成した PDF のようにセッションに置く一時ファイルは SessionFile で持つ。
+"""
+import math
+import weakref
+from pathlib import Path
+
+import pandas as pd
+import streamlit as st
+
+from image_cache import convert_google_drive_link
+from image_derivatives import load_thumbnail
+from question_db import (
+    ANSWER_KEYS,
+    CATEGORY_KEYS,
+    IMAGE_LINK_KEYS,
+    NUMBER_KEYS,
+    QUESTION_KEYS,
+    safe_get,
+)
+
+PAGE_SIZE = 20
+
+
+class SessionFile:
+    """セッションに置く一時ファイル。
+
+    セッションが終わって状態ごと捨てられたとき・discard したとき・プロセスの終了時にファイルも消す。
+    中身は read_bytes を呼んだときだけ読む（download_button に渡せば、押されたときだけ読まれる）。
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._remove = weakref.finalize(self, self.path.unlink, missing_ok=True)
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def read_bytes(self) -> bytes:
+        return self.path.read_bytes()
+
+    def discard(self):
+        self._remove()
+
+
+def page_count(total: int, page_size: int = PAGE_SIZE) -> int:
+    return max(1, math.ceil(total / page_size))
+
+
+def _state(key: str, search_key) -> dict:
+    """key ごとのページ状態。検索条件が変わったら先頭ページに戻し、世代を進める。"""
+    state = st.session_state.setdefault(key, {"page": 0, "search": None, "generation": 0})
+    if state["search"] != search_key:
+        state["page"] = 0
+        state["search"] = search_key
+        # 世代をウィジェットの key に含め、前の検索で開いた行が開いたまま残らないようにする
+        state["generation"] += 1
+    return state
+
+
+def _move(key: str, step: int, pages: int):
+    state = st.session_state[key]
+    state["page"] = min(max(state["page"] + step, 0), pages - 1)
+
+
+def result_page(total: int, key: str, search_key, page_size: int = PAGE_SIZE) -> tuple[int, int, int]:
+    """表示する範囲 [start, end) と、行ウィジェットの key に使う世代を返す。"""
+    state = _state(key, search_key)
+    pages = page_count(total, page_size)
+    state["page"] = min(state["page"], pages - 1)
+    start = state["page"] * page_size
+    return start, min(start + page_size, total), state["generation"]
+
+
+def page_nav(total: int, key: str, page_size: int = PAGE_SIZE):
+    """前へ／次へ と、いま何件目を表示しているかを描画する。"""
+    pages = page_count(total, page_size)
+    if pages <= 1:
+        return
+    page = st.session_state[key]["page"]
+    start = page * page_size
+    prev_col, info_col, next_col = st.columns([1, 2, 1], vertical_alignment="center")
+    with prev_col:
+        st.button("◀ 前へ", key=f"{key}_prev", disabled=page == 0,
+                  on_click=_move, args=(key, -1, pages), width="stretch")
+    with info_col:
+        st.caption(f"{start + 1}–{min(start + page_size, total)}件目 / {total}件（{page + 1}/{pages}ページ）")
+    with next_col:
+        st.button("次へ ▶", key=f"{key}_next", disabled=page >= pages - 1,
+                  on_click=_move, args=(key, 1, pages), width="stretch")
+
+
+def _show_record(record, generation: int, i: int, no: str, title: str):
+    if no:
+        st.markdown(f"**🆔 問題番号:** {no}")
+
+    st.markdown("### 📝 問題文")
+    st.write(title)
+
+    st.markdown("### ✏️ 選択肢")
+    for j in range(1, 6):
+        val = safe_get(record, [f"選択肢{j}"])
+        if val:
+            st.write(f"- {val}")
+
+    show_ans = st.checkbox("正解を表示する", key=f"show_answer_{generation}_{i}", value=False)
+    if show_ans:
+        st.markdown(f"**✅ 正解:** {safe_get(record, ANSWER_KEYS)}")
+    else:
+        st.markdown("**✅ 正解:** |||（クリックで表示）|||")
+
+    st.markdown(f"**📚 分類:** {safe_get(record, CATEGORY_KEYS)}")
+
+    link = safe_get(record, IMAGE_LINK_KEYS)
+    if link:
+        image_url = convert_google_drive_link(link)
+        try:
+            # 一覧用に縮小したサムネイル（初回だけ取得・縮小し、以後はキャッシュから）
+            st.image(load_thumbnail(image_url).path)
+        except Exception:
+            pass  # 取得できなければリンクだけ出す
+        st.markdown(f"[画像リンクはこちら]({image_url})")
+    else:
+        st.write("（画像リンクはありません）")
+
+
+# 1ページ分だけ描画し、中身は展開された問題だけ作る（ページ送り・展開はこの部分だけ再実行）
+@st.fragment
+def show_results(df_filtered: pd.DataFrame, search_key, key: str = "results"):
+    """検索結果の一覧（正解は初期非表示）。問題番号の列がある DB では見出しと中身に番号を出す。"""
+    start, end, generation = result_page(len(df_filtered), key, search_key)
+    for i in range(start, end):
+        record = df_filtered.iloc[i]
+        no = safe_get(record, NUMBER_KEYS)
+        title = safe_get(record, QUESTION_KEYS)
+        head = f"{i+1}. [{no}] " if no else f"{i+1}. "
+        expander = st.expander(f"{head}{title[:50]}...", key=f"result_{generation}_{i}", on_change="rerun")
+        if not expander.open:
+            continue
+        with expander:
+            _show_record(record, generation, i, no, title)
+    page_nav(len(df_filtered), key)
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# アプリのモジュールはリポジトリ直下に置いてある
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,23 @@
+import pandas as pd
+
+from exam_ids import ExamIndex, ExamQuery, parse_exam_query
+from ngram_index import NgramIndex
+from question_search import build_search_text, parse_keywords, search_rows
+
+
+def test_exam_range_query():
+    assert parse_exam_query("110-119c") == ExamQuery(110, 119, ("C",))
+    assert parse_exam_query("110-119") == ExamQuery(110, 119, ())
+
+
+def test_number_range_outside_exams_is_a_keyword():
+    # 「10-20歳」のような範囲は出典の指定ではなく部分一致で探す
+    assert parse_exam_query("10-20") is None
+
+    df = pd.DataFrame({
+        "問題文": ["10-20歳に多いのはどれか。[110A1-ori]", "高齢者に多いのはどれか。[110A2-ori]"],
+        "科目分類": ["", ""],
+    })
+    index = NgramIndex.build(build_search_text(df).tolist())
+    rows, total = search_rows(df, index, parse_keywords("10-20"), exam_index=ExamIndex.from_frame(df))
+    assert total == 1 and rows.tolist() == [0]
@@ -0,0 +1,31 @@
+import pandas as pd
+
+from question_corpus import load_corpus
+from question_dedupe import ClusterMap
+
+
+def write_db(path, rows):
+    pd.DataFrame([{"問題文": s, "選択肢1": "a", "正解": "a", "科目分類": "", "リンクURL": link} for s, link in rows]).to_csv(
+        path, index=False, encoding="utf-8-sig"
+    )
+    return path
+
+
+def test_fill_only_from_matching_exam_and_stem(tmp_path):
+    a = write_db(tmp_path / "a.csv", [("顎関節を構成する骨はどれか。[110A5-ori]", ""), ("顎関節を構成する骨はどれか。", "")])
+    b = write_db(tmp_path / "b.csv", [
+        ("顎関節を構成する骨はどれか。[111B7]", "https://example.com/other"),
+        ("顎関節を構成する骨はどれか。1つ選べ。[111B7]", "https://example.com/other"),
+    ])
+    cluster_map = ClusterMap([
+        [{"source": "a.csv", "row": 0}, {"source": "b.csv", "row": 0}],
+        [{"source": "a.csv", "row": 1}, {"source": "b.csv", "row": 1}],
+    ], {})
+    df = load_corpus([a, b], cluster_map)
+
+    # 出典の違う行のリンクでは埋めない
+    assert (df["_id"] == "a:0").sum() == 1
+    # 出典の無い行はリンクを埋めるが、問題文の違う行の出典は付けない
+    copy = df[(df["_id"] == "a:1") & ~df["_own"]]
+    assert copy["リンクURL"].tolist() == ["https://example.com/other"]
+    assert copy["_exam"].tolist() == [0]
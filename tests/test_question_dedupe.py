@@ -0,0 +1,25 @@
+import pandas as pd
+
+from question_dedupe import find_duplicates
+
+CHOICES = {f"選択肢{i}": c for i, c in enumerate(["上顎骨", "下顎骨", "頬骨", "側頭骨", "蝶形骨"], 1)}
+
+
+def write_db(path, stems):
+    pd.DataFrame([{"問題文": s, **CHOICES, "正解": "a", "科目分類": "", "リンクURL": ""} for s in stems]).to_csv(
+        path, index=False, encoding="utf-8-sig"
+    )
+    return path
+
+
+def test_different_exams_stay_separate(tmp_path):
+    stem = "顎関節を構成する骨はどれか。1つ選べ。"
+    a = write_db(tmp_path / "a.csv", [f"{stem}[110A5-ori]", f"{stem}[111B7]"])
+    # 出典の無い同じ問題が間にあっても、別の回の問題どうしはまとめない
+    b = write_db(tmp_path / "b.csv", [f"{stem}[110A5]", stem])
+    clusters, stats = find_duplicates([a, b])
+
+    ids = [{m["id"] for m in c} for c in clusters]
+    assert not any({"110A5-ori", "111B7"} <= c for c in ids)
+    assert any({"110A5-ori", "110A5"} <= c for c in ids)
+    assert stats["conflicting_pairs"] > 0
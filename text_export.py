@@ -0,0 +1,157 @@
+"""検索結果の書き出し（TXT・GoodNotes 用 CSV）。Streamlit に依存しない。"""
+import csv
+import io
+
+import pandas as pd
+
+from image_cache import convert_google_drive_link
+from question_db import (
+    ANSWER_KEYS,
+    CATEGORY_KEYS,
+    IMAGE_LINK_KEYS,
+    NUMBER_KEYS,
+    QUESTION_KEYS,
+    ensure_output_columns,
+    safe_get,
+)
+
+# TXT で問題どうしの間に入れる区切り
+TEXT_SEPARATOR = "\n\n" + "-"*40 + "\n\n"
+
+
+# ===== TXT 整形 =====
+def format_record_to_text(row: pd.Series) -> str:
+    parts = []
+    no = safe_get(row, NUMBER_KEYS)
+    if no:
+        parts.append(f"問題番号: {no}")
+    parts.append(f"問題文: {safe_get(row, QUESTION_KEYS)}")
+    for i in range(1, 6):
+        choice = safe_get(row, [f"選択肢{i}"])
+        if choice:
+            parts.append(f"選択肢{i}: {choice}")
+    parts.append(f"正解: {safe_get(row, ANSWER_KEYS)}")
+    parts.append(f"分類: {safe_get(row, CATEGORY_KEYS)}")
+    link = safe_get(row, IMAGE_LINK_KEYS)
+    if link:
+        parts.append(f"画像リンク: {convert_google_drive_link(link)}（PDFに画像表示）")
+    return "\n".join(parts)
+
+
+def records_to_text(df: pd.DataFrame) -> str:
+    """TXT ダウンロード用に、全問題を区切り線つきで連結する"""
+    buf = io.StringIO()
+    for _, row in df.iterrows():
+        buf.write(format_record_to_text(row))
+        buf.write(TEXT_SEPARATOR)
+    return buf.getvalue()
+
+
+# ===== GoodNotes 用 CSV（Front/Back）=====
+# 大きなデッキでも Front/Back の文字列を一度に全部は持たないよう、この行数ずつ作って書き出す
+GOODNOTES_CHUNK_ROWS = 2000
+GOODNOTES_LABELS = {
+    "ABC": ["A", "B", "C", "D", "E"],
+    "123": ["1", "2", "3", "4", "5"],
+}
+
+
+def _gn_clean(col: pd.Series) -> pd.Series:
+    """BOM を除き、前後の空白と全角スペースを取る"""
+    # 欠損は行ごとに処理していた頃と同じく "nan" になる（iterrows が None も NaN にしていた）
+    col = col.astype(object).where(col.notna(), "nan")
+    # object 列の .str は要素ごとの Python 呼び出しなので、3つの処理を1回の走査にまとめる
+    return pd.Series(
+        [str(v).replace("\ufeff", "").strip().replace("　", "") for v in col],
+        index=col.index,
+        dtype=object,
+    )
+
+
+def _gn_normalize_newlines(col: pd.Series) -> pd.Series:
+    """セル内の改行をLFに統一"""
+    return col.str.replace(r"\r\n|\r", "\n", regex=True)
+
+
+def goodnotes_front_back(df: pd.DataFrame,
+                         numbering: str = "ABC",
+                         add_labels: bool = True,
+                         add_meta: bool = False) -> tuple[pd.Series, pd.Series]:
+    """Front（問題文＋選択肢）と Back（正解ほか）を列単位でまとめて作る。"""
+    base = ensure_output_columns(df)
+    labels = GOODNOTES_LABELS["ABC"] if numbering == "ABC" else GOODNOTES_LABELS["123"]
+
+    # 空でない選択肢だけを「A. 本文」の形で改行区切りにつなぐ
+    choice_lines = pd.Series("", index=base.index, dtype=object)
+    for i, label in enumerate(labels, start=1):
+        txt = _gn_clean(base[f"選択肢{i}"])
+        line = f"{label}. " + _gn_normalize_newlines(txt)
+        appended = line.where(choice_lines == "", choice_lines + "\n" + line)
+        choice_lines = appended.where(txt != "", choice_lines)
+
+    front = _gn_normalize_newlines(_gn_clean(base["問題文"]))
+    front = front.where(choice_lines == "", front + "\n\n" + choice_lines)
+
+    ans = _gn_clean(base["正解"])
+    back = "正解: " + ans if add_labels else ans
+
+    if add_meta:
+        subject = _gn_clean(base["科目分類"])
+        link = _gn_clean(base["リンクURL"])
+        extra = subject.where(link == "", subject + "\n" + link).where(subject != "", link)
+        back = back.where(extra == "", back + "\n\n" + _gn_normalize_newlines(extra))
+
+    # LF への統一は何度かけても同じなので、最後に Back へ1回だけかける
+    return front, _gn_normalize_newlines(back)
+
+
+def write_goodnotes_csv(df: pd.DataFrame,
+                        out,
+                        numbering: str = "ABC",
+                        add_labels: bool = True,
+                        add_meta: bool = False,
+                        overall_line_ending: str = "lf",
+                        quote_all: bool = False,
+                        chunk_rows: int = GOODNOTES_CHUNK_ROWS):
+    """GoodNotes 用 Front/Back CSV（BOM付き）をテキストストリーム out へ順に書き出す。"""
+    # ファイルの行末
+    file_nl = "\n" if overall_line_ending.lower() == "lf" else "\r\n"
+    # DataFrame.to_csv と同じ設定の csv.writer なので、出力は to_csv と同じになる
+    writer = csv.writer(
+        out,
+        lineterminator=file_nl,
+        quoting=csv.QUOTE_ALL if quote_all else csv.QUOTE_MINIMAL,
+        doublequote=True,
+        escapechar="\\",
+    )
+    out.write("\ufeff")  # BOM
+    writer.writerow(["Front", "Back"])
+    for start in range(0, len(df), chunk_rows):
+        fronts, backs = goodnotes_front_back(
+            df.iloc[start:start + chunk_rows], numbering=numbering, add_labels=add_labels, add_meta=add_meta
+        )
+        writer.writerows(zip(fronts.tolist(), backs.tolist()))
+
+
+def dataframe_to_goodnotes_bytes(df: pd.DataFrame,
+                                 numbering: str = "ABC",
+                                 add_labels: bool = True,
+                                 add_meta: bool = False,
+                                 overall_line_ending: str = "lf",
+                                 quote_all: bool = False) -> bytes:
+    """
+    任意の DataFrame から GoodNotes 用 Front/Back CSV を UTF-8(BOM付き) bytes で返す。
+    - セル内部の改行は LF に正規化（GoodNotesでの表示安定のため）
+    - ファイル全体の改行は overall_line_ending で 'lf' or 'crlf'
+    """
+    buf = io.StringIO()
+    write_goodnotes_csv(
+        df,
+        buf,
+        numbering=numbering,
+        add_labels=add_labels,
+        add_meta=add_meta,
+        overall_line_ending=overall_line_ending,
+        quote_all=quote_all,
+    )
+    return buf.getvalue().encode("utf-8")
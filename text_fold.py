@@ -0,0 +1,27 @@
+"""検索用の表記ゆれの吸収（全角・半角、カタカナ・ひらがな、ローマ数字、ダッシュ類）。
+
+読み込み時に検索用テキスト（とその n-gram インデックス）へ一度だけ掛け、検索語にも同じ変換を掛ける。
+「１１８」と「118」、「レジン」と「れじん」と「ﾚｼﾞﾝ」、「Ⅳ」と「ⅳ」、「3ヶ月」と「3か月」が同じ語として当たる。
+画面・書き出しには元の表記を使い、ここで変換した文字列は照合にだけ使う。
+"""
+import re
+import unicodedata
+
+# ローマ数字は NFKC だと英字（Ⅳ→IV）になり、画像リンクの「drive」「view」にまで当たってしまう。
+# NFKC の前に私用領域へ逃がし、後で大文字のローマ数字（Ⅰ〜Ⅿ）に戻す（小文字の ⅳ も Ⅳ にそろう）
+_ROMAN_RE = re.compile("[Ⅰ-ⅿ]")
+_ROMAN_PROTECT = str.maketrans({cp: 0xE000 + (cp & 0xF) for cp in range(0x2160, 0x2180)})
+_ROMAN_RESTORE = {0xE000 + i: 0x2160 + i for i in range(16)}
+# カタカナ（ァ〜ヶ）→ ひらがな。長音符「ー」はそのまま。「3ヶ月」「3カ月」「3か月」の小書きのヵ・ヶも「か」に
+_KANA_FOLD = {cp: cp - 0x60 for cp in range(0x30A1, 0x30F7)}
+_KANA_FOLD.update(dict.fromkeys(map(ord, "ヵヶゕゖ"), ord("か")))
+# NFKC では半角ハイフンにならないダッシュ・マイナス類（「110–119C」のような範囲の指定にも効く）
+_DASH_FOLD = dict.fromkeys(map(ord, "‐‑‒–—―−"), ord("-"))
+_FOLD_TABLE = str.maketrans({**_KANA_FOLD, **_DASH_FOLD, **_ROMAN_RESTORE})
+
+
+def fold_text(text: str) -> str:
+    """NFKC（全角英数→半角・半角カナ→全角 など）→ 小文字化 → カタカナをひらがなに"""
+    if _ROMAN_RE.search(text) is not None:
+        text = text.translate(_ROMAN_PROTECT)
+    return unicodedata.normalize("NFKC", text).lower().translate(_FOLD_TABLE)
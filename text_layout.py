@@ -0,0 +1,103 @@
+"""PDF 用の文字幅計算と行折り返し。
+
+以前の wrap_text は1文字足すたびに「バッファ全体」の幅を測り直していたため、
+フォント振り分け・幅計算が文字列長の2乗で増えていた。
+ここでは
+- 文字（コードポイント）ごとの収録フォントの振り分け結果
+- (フォント, サイズ, 文字) ごとの幅
+をキャッシュし、折り返しは追加した1文字分の幅を足していくだけにする（文字数に比例）。
+"""
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.pdfmetrics import stringWidth
+
+
+class TextLayout:
+    def __init__(self, primary: str, fallback: str | None = None, symbol: str | None = None,
+                 symbol_chars=frozenset(), fallback_re=None):
+        """primary: 本文フォント / fallback: 本文フォントに無い文字用 / symbol: 記号専用
+
+        symbol_chars の文字は symbol を、fallback_re に一致する文字は fallback を優先する。
+        """
+        self.primary = primary
+        self.fallback = fallback
+        self.symbol = symbol
+        self.symbol_chars = symbol_chars
+        self.fallback_re = fallback_re
+        self._font_by_char: dict[str, str] = {}
+        self._width: dict[tuple[str, float, str], float] = {}
+        self._coverage: dict[str, frozenset | None] = {}
+
+    def _has_character(self, font_name: str | None, ch: str) -> bool:
+        if not font_name:
+            return False
+        if font_name not in self._coverage:
+            try:
+                widths = getattr(pdfmetrics.getFont(font_name).face, "charWidths", {})
+                self._coverage[font_name] = frozenset(widths)
+            except Exception:
+                self._coverage[font_name] = None
+        coverage = self._coverage[font_name]
+        return coverage is not None and ord(ch) in coverage
+
+    def _choose_font(self, ch: str) -> str:
+        if ch in self.symbol_chars and self._has_character(self.symbol, ch):
+            return self.symbol
+        if self.fallback_re is not None and self.fallback_re.match(ch) and self._has_character(self.fallback, ch):
+            return self.fallback
+        for font in (self.primary, self.fallback, self.symbol):
+            if self._has_character(font, ch):
+                return font
+        return self.primary
+
+    def font_for(self, ch: str) -> str:
+        font = self._font_by_char.get(ch)
+        if font is None:
+            font = self._font_by_char[ch] = self._choose_font(ch)
+        return font
+
+    def char_width(self, ch: str, size: float) -> float:
+        font = self.font_for(ch)
+        key = (font, size, ch)
+        w = self._width.get(key)
+        if w is None:
+            w = self._width[key] = stringWidth(ch, font, size)
+        return w
+
+    def split_runs(self, text: str):
+        """各文字を収録フォントへ振り分け、連続する同一フォントをまとめる。"""
+        if not text:
+            return [(self.primary, "")]
+        runs = []
+        buf, current_font = [], None
+        for ch in text:
+            font = self.font_for(ch)
+            if current_font is None:
+                current_font = font
+            if font != current_font:
+                runs.append((current_font, "".join(buf)))
+                buf, current_font = [], font
+            buf.append(ch)
+        if buf:
+            runs.append((current_font, "".join(buf)))
+        return runs
+
+    def text_width(self, text: str, size: float) -> float:
+        return sum(self.char_width(ch, size) for ch in text)
+
+    def wrap(self, text: str, max_width: float, size: float) -> list[str]:
+        """max_width を超えない位置で1文字単位に折り返す。"""
+        s = "" if text is None else str(text)
+        if s == "":
+            return [""]
+        lines, buf, width = [], [], 0.0
+        for ch in s:
+            w = self.char_width(ch, size)
+            if width + w <= max_width:
+                buf.append(ch)
+                width += w
+            else:
+                lines.append("".join(buf))
+                buf, width = [ch], w
+        if buf:
+            lines.append("".join(buf))
+        return lines